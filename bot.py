@@ -2,20 +2,30 @@ from __future__ import annotations
 
 import os
 import json
+from functools import lru_cache
 from html import escape
+from operator import attrgetter, itemgetter
 from pathlib import Path
+from typing import Callable
 from urllib.parse import quote
 import time
 import logging
+import signal
 import sys
+import threading
+from collections import Counter, OrderedDict
 
+import requests
 import telebot
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
 from telebot.types import (
     BotCommand,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
+from urllib3.util.retry import Retry
 
 import re
 from datetime import datetime
@@ -29,6 +39,7 @@ from loungebot.admin_stats import (
     admin_marked_visits_counts,
     admin_marked_visits_summary,
     admin_marked_recent_clients_page,
+    dashboard_counts,
     inc_action,
     find_user_id_by_username,
     get_user_stats,
@@ -36,7 +47,6 @@ from loungebot.admin_stats import (
     inc_click,
     recent_visit_events,
     recent_subscribers,
-    subscribed_counts,
     top_by_clicks,
     top_by_clicks_paged,
     top_by_visits_paged,
@@ -46,15 +56,13 @@ from loungebot.admin_stats import (
     touch_user,
     unsubscribed_counts,
     filter_user_ids_by_broadcast_cooldown,
-    record_broadcast_sent,
+    record_broadcasts_sent,
     top_users_by_visits_in_month,
     users_no_visits_between_days,
     users_no_visits_for_days,
     users_last_visit_older_than_days,
-    visit_counts,
     user_visit_counts,
-    add_visit_marked,
-    can_add_visit_today_tyumen,
+    add_visit_marked_if_allowed,
 )
 from loungebot.admin_roles import (
     add_admin_by_username,
@@ -69,6 +77,7 @@ from loungebot.guest_cards import is_registered, register_card
 from loungebot.level_cards import (
     LevelCard,
     add_visit_by_user_id,
+    card_transaction,
     clear_staff_gold_by_user_id,
     ensure_level_card,
     find_card_by_number,
@@ -137,11 +146,31 @@ def _patch_inline_button_style() -> None:
 _patch_inline_button_style()
 
 
-def _tyumen_now() -> datetime:
+def _resolve_tyumen_tz() -> ZoneInfo | None:
     try:
-        return datetime.now(ZoneInfo("Asia/Tyumen"))
+        return ZoneInfo("Asia/Tyumen")
     except Exception:
+        return None
+
+
+# Resolved once at import; None means no tzdata, callers fall back to local time.
+_TYUMEN_TZ = _resolve_tyumen_tz()
+
+
+def _tyumen_now() -> datetime:
+    if _TYUMEN_TZ is None:
         return datetime.now().astimezone()
+    return datetime.now(_TYUMEN_TZ)
+
+
+@lru_cache(maxsize=4096)
+def _tyumen_dt(raw: str) -> datetime | None:
+    # Stored ISO timestamp -> Tyumen-local datetime for display; naive values are server-local time.
+    # Visit/join lists re-render the same timestamps on every page flip.
+    try:
+        return datetime.fromisoformat(raw).astimezone(_TYUMEN_TZ)
+    except Exception:
+        return None
 
 
 def _prev_month(dt: datetime) -> tuple[int, int]:
@@ -456,6 +485,13 @@ def is_menu_allowed(user_id: int | None) -> bool:
     return not locked
 
 
+@lru_cache(maxsize=1024)
+def _at_username(username: str) -> str:
+    # "@name" escaped for HTML; the same handful of usernames repeat across admin screens.
+    return f"@{escape(username)}"
+
+
+@lru_cache(maxsize=4096)
 def _tg_user_link(user_id: int, username: str | None = None) -> str:
     # `tg://user?id=` is flaky on some Telegram clients for users other than yourself.
     # Prefer a public @username link when available.
@@ -497,14 +533,11 @@ def _display_first_name(uid: int, *, fallback_username: str | None = None) -> st
     return f"ID {int(uid)}"
 
 
+_RANKS = ("🥇", "🥈", "🥉")
+
+
 def _rank_prefix(i: int) -> str:
-    if i == 1:
-        return "🥇"
-    if i == 2:
-        return "🥈"
-    if i == 3:
-        return "🥉"
-    return f"{i}. "
+    return _RANKS[i - 1] if 1 <= i <= len(_RANKS) else f"{i}. "
 
 
 def _fmt_date_ymd(d: datetime) -> str:
@@ -537,28 +570,41 @@ def _is_staff_user_id(user_id: int, username: str | None) -> bool:
         return False
 
 
-def main_inline_keyboard(*, superadmin: bool, admin: bool) -> InlineKeyboardMarkup:
-    # "admin" here means non-superadmin staff account.
-    # Superadmins keep the admin menu button as-is.
+def _main_keyboard_base() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     keyboard.row(InlineKeyboardButton(text=BTN_GUEST_CARD, callback_data="main_guest_card"))
     keyboard.row(InlineKeyboardButton(text=BTN_MENU, callback_data="main_menu"))
     keyboard.row(InlineKeyboardButton(text=BTN_BOOKING, url=booking_deep_link()))
     keyboard.row(InlineKeyboardButton(text=BTN_LOCATION, callback_data="main_location"))
-    if superadmin:
-        keyboard.row(
-            InlineKeyboardButton(
-                text=f"👀superadmin {active_subscribers_count()}",
-                callback_data="main_admin",
-            )
+    return keyboard
+
+
+def main_inline_keyboard(*, superadmin: bool, admin: bool) -> InlineKeyboardMarkup:
+    # "admin" here means non-superadmin staff account.
+    # Superadmins keep the admin menu button as-is.
+    if not superadmin:
+        # Guest/admin variants are static; only the superadmin one shows a live counter.
+        return _static_main_inline_keyboard(admin=admin)
+    keyboard = _main_keyboard_base()
+    keyboard.row(
+        InlineKeyboardButton(
+            text=f"👀superadmin {active_subscribers_count()}",
+            callback_data="main_admin",
         )
-        keyboard.row(
-            InlineKeyboardButton(
-                text="➕ Добавить визит",
-                callback_data="main_add_visit",
-            )
+    )
+    keyboard.row(
+        InlineKeyboardButton(
+            text="➕ Добавить визит",
+            callback_data="main_add_visit",
         )
-    elif admin:
+    )
+    return keyboard
+
+
+@lru_cache(maxsize=None)
+def _static_main_inline_keyboard(*, admin: bool) -> InlineKeyboardMarkup:
+    keyboard = _main_keyboard_base()
+    if admin:
         keyboard.row(
             InlineKeyboardButton(
                 text="➕ Добавить визит",
@@ -568,6 +614,7 @@ def main_inline_keyboard(*, superadmin: bool, admin: bool) -> InlineKeyboardMark
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def guest_card_inline_keyboard() -> InlineKeyboardMarkup:
     # For new users: only registration button (no tabs yet).
     keyboard = InlineKeyboardMarkup()
@@ -579,6 +626,7 @@ def guest_card_registered_inline_keyboard() -> InlineKeyboardMarkup:
     return level_keyboard(registered=True, active="card")
 
 
+@lru_cache(maxsize=None)
 def level_keyboard(*, registered: bool, active: str) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
 
@@ -608,6 +656,7 @@ def level_keyboard(*, registered: bool, active: str) -> InlineKeyboardMarkup:
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def location_inline_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     keyboard.row(
@@ -642,7 +691,12 @@ def interior_keyboard(idx: int) -> InlineKeyboardMarkup:
         i = 1
     if i > INTERIOR_COUNT:
         i = INTERIOR_COUNT
+    # idx comes from callback data; cache only on the clamped photo number.
+    return _interior_keyboard(i)
+
 
+@lru_cache(maxsize=None)
+def _interior_keyboard(i: int) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
 
     # Navigation row
@@ -668,10 +722,10 @@ def send_interior(chat_id: int, *, idx: int) -> None:
     if not p.exists():
         bot.send_message(chat_id, "Фото интерьера не найдено.", reply_markup=location_inline_keyboard())
         return
-    with p.open("rb") as f:
-        bot.send_photo(chat_id, f, reply_markup=interior_keyboard(idx))
+    _send_cached_photo(chat_id, p, reply_markup=interior_keyboard(idx))
 
 
+@lru_cache(maxsize=None)
 def pitbike_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     kb.row(InlineKeyboardButton(text="📸 Интерьер", callback_data="location_interior"))
@@ -685,9 +739,8 @@ def send_pitbike_photo(chat_id: int) -> None:
     if not p.exists():
         bot.send_message(chat_id, "Фото питбайка не найдено.")
         return
-    with p.open("rb") as f:
-        # Deep-link should just drop the photo without additional menus.
-        bot.send_photo(chat_id, f)
+    # Deep-link should just drop the photo without additional menus.
+    _send_cached_photo(chat_id, p)
 
 
 def send_mangal_kebab_photo(chat_id: int) -> None:
@@ -699,10 +752,10 @@ def send_mangal_kebab_photo(chat_id: int) -> None:
     if not p.exists():
         bot.send_message(chat_id, "Фото МАНГАЛ🔥КЕБАБ не найдено.")
         return
-    with p.open("rb") as f:
-        bot.send_photo(chat_id, f)
+    _send_cached_photo(chat_id, p)
 
 
+@lru_cache(maxsize=None)
 def menu_inline_keyboard(
     *,
     active: str | None = None,
@@ -731,12 +784,14 @@ def menu_inline_keyboard(
     return keyboard
 
 
+@lru_cache(maxsize=None)
 def booking_deep_link() -> str:
     admin = BOOKING_ADMIN.lstrip("@").strip()
     message = quote(BOOKING_TEXT, safe="")
     return f"https://t.me/{admin}?text={message}"
 
 
+@lru_cache(maxsize=None)
 def booking_inline_keyboard() -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     keyboard.row(InlineKeyboardButton(text=BTN_BOOKING, url=booking_deep_link()))
@@ -940,19 +995,14 @@ def _staff_user_ids_known() -> set[int]:
     Includes:
     - superadmins (env or default)
     - admins with synced user_id
-    - admins whose @username matches an active user record (even if user_id wasn't synced into admin_roles yet)
+    - admins whose @username matches a known user record (even if user_id wasn't synced into admin_roles yet)
     """
-    ids = set(_superadmin_ids()) | set(admin_user_ids())
+    ids = _superadmin_ids() | admin_user_ids()
     try:
-        admin_names = {normalize_username(r.username) for r in list_admins()}
-        for uid in active_user_ids():
-            st = get_user_stats(int(uid)) or {}
-            u = st.get("username")
-            if isinstance(u, str):
-                u = normalize_username(u)
-            else:
-                u = ""
-            if u and u in admin_names:
+        # One indexed lookup per admin instead of walking every user record.
+        for r in list_admins():
+            uid = find_user_id_by_username(r.username)
+            if uid is not None:
                 ids.add(int(uid))
     except Exception:
         pass
@@ -1247,7 +1297,214 @@ if LOCATION_ADDRESS.strip() == "Мы находимся по адресу:":
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set in .env")
 
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills `rate` tokens per second, bursts up to `capacity`.
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate: float = 28.0, capacity: float = 30.0) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait_s = (1.0 - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+
+class TTLDict:
+    """
+    Small thread-safe dict whose entries expire `ttl` seconds after being set.
+    Expired keys are dropped lazily on access plus an occasional full sweep.
+    """
+
+    _SWEEP_EVERY = 256
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = float(ttl)
+        self._data: dict = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def _sweep_locked(self, now: float) -> None:
+        self._ops += 1
+        if self._ops % self._SWEEP_EVERY:
+            return
+        for k in [k for k, (_v, exp) in self._data.items() if exp <= now]:
+            del self._data[k]
+
+    def _get_locked(self, key, now: float):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def __setitem__(self, key, value) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep_locked(now)
+            self._data[key] = (value, now + self.ttl)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._get_locked(key, time.monotonic()) is not None
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for _v, exp in self._data.values() if exp > now)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._get_locked(key, time.monotonic())
+        return default if item is None else item[0]
+
+    def pop(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._get_locked(key, now)
+            self._data.pop(key, None)
+            self._sweep_locked(now)
+        return default if item is None else item[0]
+
+
+class TTLSet:
+    """Set counterpart of TTLDict (membership expires `ttl` seconds after add)."""
+
+    def __init__(self, ttl: float) -> None:
+        self._d = TTLDict(ttl)
+
+    def add(self, key) -> None:
+        self._d[key] = True
+
+    def discard(self, key) -> None:
+        self._d.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        return key in self._d
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+
+class RecentKeys:
+    """
+    Bounded LRU of recently seen keys with their monotonic timestamp, for dedupe windows.
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = int(maxsize)
+        self._seen: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen_within(self, key, window_s: float) -> bool:
+        """True if `key` was recorded less than `window_s` ago; otherwise records it now."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._seen.get(key)
+            if last is not None and now - last < window_s:
+                return True
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            if len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+        return False
+
+
+class _RateLimitedTeleBot(telebot.TeleBot):
+    """
+    Outgoing sends share one bot-wide bucket so bursts (broadcasts, many users at once)
+    stay under Telegram's ~30 msg/s cap instead of tripping 429 flood control.
+    Messages into one chat additionally go through a small per-chat bucket (~1 msg/s
+    sustained, short bursts allowed so a reply plus its follow-up isn't delayed).
+    """
+
+    CHAT_RATE = 1.0
+    CHAT_BURST = 3.0
+    # An idle chat's bucket is full again after a few seconds, so forgetting it loses nothing.
+    CHAT_BUCKET_TTL_S = 60.0
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.send_bucket = TokenBucket()
+        self._chat_buckets = TTLDict(ttl=self.CHAT_BUCKET_TTL_S)
+        self._chat_buckets_lock = threading.Lock()
+
+    def _throttle(self, chat_id) -> None:
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(rate=self.CHAT_RATE, capacity=self.CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        # Wait for the chat first so we don't hold a global token while sleeping.
+        bucket.acquire()
+        self.send_bucket.acquire()
+
+    def send_message(self, chat_id, *args, **kwargs):
+        self._throttle(chat_id)
+        return super().send_message(chat_id, *args, **kwargs)
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        self._throttle(chat_id)
+        return super().send_photo(chat_id, *args, **kwargs)
+
+    def send_location(self, chat_id, *args, **kwargs):
+        self._throttle(chat_id)
+        return super().send_location(chat_id, *args, **kwargs)
+
+    def copy_message(self, chat_id, *args, **kwargs):
+        self._throttle(chat_id)
+        return super().copy_message(chat_id, *args, **kwargs)
+
+    def send_chat_action(self, chat_id, *args, **kwargs):
+        # Not a message, so it doesn't count against the chat's budget.
+        self.send_bucket.acquire()
+        return super().send_chat_action(chat_id, *args, **kwargs)
+
+
+# Worker threads for update handlers (telebot default is 2). More workers keep one slow
+# handler (stats, broadcast preview) from stalling everyone else during bursts.
+try:
+    BOT_NUM_THREADS = max(int(os.getenv("BOT_NUM_THREADS", "8")), 1)
+except ValueError:
+    BOT_NUM_THREADS = 8
+
+bot = _RateLimitedTeleBot(BOT_TOKEN, parse_mode="HTML", num_threads=BOT_NUM_THREADS)
+
+
+def _make_api_session() -> requests.Session:
+    """
+    One keep-alive session shared by all worker threads (telebot otherwise opens one per thread),
+    with a pool big enough that concurrent sends reuse warm TLS connections.
+    Only connection setup is retried: resending a POST that may have gone through would duplicate messages.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=max(BOT_NUM_THREADS * 2, 16),
+        max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.2),
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+apihelper.session = _make_api_session()
+apihelper.CONNECT_TIMEOUT = 10
+apihelper.READ_TIMEOUT = 30
 
 
 def _first_superadmin_id() -> int | None:
@@ -1305,6 +1562,83 @@ def _clear_main_menu_cache() -> None:
         pass
 
 
+def _photo_cache_file() -> Path:
+    return Path("data") / "photo_cache.json"
+
+
+# path -> {"mtime": int, "photo_file_id": str} for gallery/promo photos (the welcome photo has its own cache).
+_photo_cache: dict[str, dict] | None = None
+_photo_cache_lock = threading.Lock()
+
+
+def _cached_photo_file_id(p: Path) -> str | None:
+    global _photo_cache
+    try:
+        mtime = int(p.stat().st_mtime)
+    except Exception:
+        return None
+    with _photo_cache_lock:
+        if _photo_cache is None:
+            try:
+                loaded = json.loads(_photo_cache_file().read_text(encoding="utf-8"))
+            except Exception:
+                loaded = {}
+            _photo_cache = loaded if isinstance(loaded, dict) else {}
+        rec = _photo_cache.get(str(p))
+    if isinstance(rec, dict) and int(rec.get("mtime") or 0) == mtime and rec.get("photo_file_id"):
+        return str(rec["photo_file_id"])
+    return None
+
+
+def _remember_photo_file_id(p: Path, msg: object) -> None:
+    photos = getattr(msg, "photo", None)
+    if not photos:
+        return
+    try:
+        with _photo_cache_lock:
+            if _photo_cache is None:
+                return
+            _photo_cache[str(p)] = {"mtime": int(p.stat().st_mtime), "photo_file_id": photos[-1].file_id}
+            Path("data").mkdir(parents=True, exist_ok=True)
+            _photo_cache_file().write_text(json.dumps(_photo_cache, ensure_ascii=False, indent=2), encoding="utf-8")
+    except Exception:
+        pass
+
+
+def _forget_photo_file_id(p: Path) -> None:
+    with _photo_cache_lock:
+        if _photo_cache is not None:
+            _photo_cache.pop(str(p), None)
+
+
+def _is_bad_file_id_error(e: Exception) -> bool:
+    """Telegram rejected the file_id itself ("wrong file identifier"), as opposed to any other failure."""
+    if not isinstance(e, apihelper.ApiTelegramException):
+        return False
+    desc = str(e.description or "").lower()
+    return "file identifier" in desc or "file_id" in desc or "file id" in desc
+
+
+def _send_cached_photo(chat_id: int, p: Path, **kwargs):
+    """
+    send_photo() for a local file: reuse Telegram's file_id for this file version when known,
+    upload (and remember the new file_id) otherwise. A rejected file_id is dropped and uploaded once;
+    other errors (timeouts, 429, blocked user) are raised as is.
+    """
+    file_id = _cached_photo_file_id(p)
+    if file_id:
+        try:
+            return bot.send_photo(chat_id, file_id, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            if not _is_bad_file_id_error(e):
+                raise
+            _forget_photo_file_id(p)
+    with p.open("rb") as f:
+        msg = bot.send_photo(chat_id, f, **kwargs)
+    _remember_photo_file_id(p, msg)
+    return msg
+
+
 def ensure_main_menu_photo_file_id() -> str | None:
     """
     Keep the main menu photo file_id across restarts to avoid re-uploading
@@ -1425,13 +1759,76 @@ def _build_info_text() -> str:
     return f"Build: <b>{escape(ver)}</b>\nSource: <b>{escape(BOT_SOURCE)}</b>\nFile: <code>bot.py</code> mtime {escape(mtime)}"
 
 # Best-effort guards against duplicate UI actions.
-_recent_callback_keys: dict[tuple[int, str, int], float] = {}
+_recent_callback_keys = RecentKeys()  # (chat_id, message_id, data)
 _main_menu_photo_file_id: str | None = None
 _main_menu_message_id_by_chat: dict[int, int] = {}
-_recent_message_keys: dict[tuple[int, int], float] = {}
-_pending_admin_add: set[int] = set()
-_pending_visit_add: dict[int, str] = {}  # chat_id -> back_cb
+_recent_message_keys = RecentKeys()  # (chat_id, message_id)
+# Abandoned input flows expire on their own instead of lingering forever.
+PENDING_INPUT_TTL_S = 300
+_pending_admin_add = TTLSet(ttl=PENDING_INPUT_TTL_S)
+_pending_visit_add = TTLDict(ttl=PENDING_INPUT_TTL_S)  # chat_id -> back_cb
 _pending_broadcast: dict[int, dict[str, object]] = {}  # chat_id -> state
+# Delivered broadcast recipients are recorded in batches of this size (one stats load/save each).
+BROADCAST_RECORD_BATCH = 50
+
+# Callback routing. Exact actions match the whole callback data,
+# prefix actions match "<action>:<args>" by the part before the first ":"
+# and get the "<args>" part passed in, so handlers never re-split call.data.
+_CB_EXACT: dict[str, Callable[[telebot.types.CallbackQuery], None]] = {}
+_CB_PREFIX: dict[str, Callable[[telebot.types.CallbackQuery, str], None]] = {}
+
+
+def _cb(*actions: str):
+    def deco(fn):
+        for action in actions:
+            _CB_EXACT[action] = fn
+        return fn
+
+    return deco
+
+
+def _cb_prefix(*actions: str):
+    def deco(fn):
+        for action in actions:
+            _CB_PREFIX[action] = fn
+        return fn
+
+    return deco
+
+
+def _callback_route(data: str) -> tuple[Callable[..., None], str | None] | None:
+    """(handler, args) for the callback data; args is None for exact actions."""
+    handler = _CB_EXACT.get(data)
+    if handler is not None:
+        return (handler, None)
+    action, sep, args = data.partition(":")
+    if sep:
+        handler = _CB_PREFIX.get(action)
+        if handler is not None:
+            return (handler, args)
+    return None
+
+
+def _quick_ack(call: telebot.types.CallbackQuery) -> None:
+    # Answer before any handler work so Telegram's loading spinner stops right away.
+    try:
+        # Explicit empty text to avoid any client-side "updated" toasts.
+        bot.answer_callback_query(call.id, text="", show_alert=False)
+    except Exception:
+        pass
+
+
+@bot.callback_query_handler(func=lambda call: _callback_route(call.data or "") is not None)
+def handle_callback(call: telebot.types.CallbackQuery) -> None:
+    _quick_ack(call)
+    route = _callback_route(call.data or "")
+    if route is None:
+        return
+    handler, args = route
+    if args is None:
+        handler(call)
+    else:
+        handler(call, args)
 
 
 def _pending_broadcast_file() -> Path:
@@ -1492,84 +1889,73 @@ def _save_pending_broadcast() -> None:
     except Exception:
         pass
 
-def _callback_guard(call: telebot.types.CallbackQuery, window_s: float = 1.5) -> bool:
+def _track_user(user: telebot.types.User) -> None:
     """
-    Prevent duplicate callback processing (double-taps, client retries, lag).
-    Also answer callback ASAP to stop Telegram's loading spinner.
+    Per-update bookkeeping: stats profile, admin roster sync, staff card and click counter.
+    Storage errors must never block the handler itself.
     """
     try:
-        # Explicit empty text to avoid any client-side "updated" toasts.
-        bot.answer_callback_query(call.id, text="", show_alert=False)
+        touch_user(
+            UserInfo(
+                user_id=user.id,
+                first_name=user.first_name,
+                last_name=user.last_name,
+                username=user.username,
+            )
+        )
+        sync_from_user(user.id, user.username, user.first_name, user.last_name)
+        # Staff accounts always have a dedicated staff card (no visits are added by this).
+        if _is_staff(user):
+            staff_level = _staff_level_label(user.id, user.username) or "ADMIN🐧"
+            set_staff_gold_by_user_id(
+                user.id,
+                staff_level=staff_level,
+                staff_discount=staff_discount_for_user(user.id),
+                username=user.username,
+                first_name=user.first_name,
+                last_name=user.last_name,
+            )
+        else:
+            # If a user was previously staff and got demoted, drop staff card and
+            # recalculate their LEVEL from visits.
+            clear_staff_gold_by_user_id(user.id)
+        inc_click(user.id)
     except Exception:
         pass
 
+
+def _callback_guard(call: telebot.types.CallbackQuery, window_s: float = 1.5) -> bool:
+    """
+    Prevent duplicate callback processing (double-taps, client retries, lag).
+    The callback itself is already answered by the dispatcher (_quick_ack).
+    """
     if call.message is None:
-        # Inline-mode callbacks won't have a chat to reply to in this bot; but we still
-        # answered the callback above to avoid "stuck" spinners.
+        # Inline-mode callbacks won't have a chat to reply to in this bot; the spinner
+        # was still stopped by _quick_ack.
         return False
 
-    try:
-        # If a broadcast flow is pending and user navigates anywhere outside broadcast UI,
-        # cancel it immediately. This prevents "stuck" broadcast state from swallowing input.
-        chat_id = call.message.chat.id
-        data0 = (call.data or "").strip()
-        if chat_id in _pending_broadcast and not data0.startswith("admin_broadcast"):
-            _pending_broadcast.pop(chat_id, None)
-            _save_pending_broadcast()
+    data = call.data or ""
+    user = call.from_user
+    chat_id = call.message.chat.id
+    if _recent_callback_keys.seen_within((chat_id, call.message.message_id, data), window_s):
+        return False
 
-        user_id = call.from_user.id if call.from_user else 0
-        data = call.data or ""
-        msg_id = call.message.message_id
-        key = (user_id, data, msg_id)
-        now = time.time()
-        last = _recent_callback_keys.get(key, 0.0)
-        if now - last < window_s:
-            return False
-        _recent_callback_keys[key] = now
-        if call.from_user:
-            touch_user(
-                UserInfo(
-                    user_id=user_id,
-                    first_name=call.from_user.first_name,
-                    last_name=call.from_user.last_name,
-                    username=call.from_user.username,
-                )
-            )
-            sync_from_user(
-                user_id,
-                call.from_user.username,
-                call.from_user.first_name,
-                call.from_user.last_name,
-            )
-            # Staff accounts always have a dedicated staff card (no visits are added by this).
-            if _is_staff(call.from_user):
-                staff_level = _staff_level_label(user_id, call.from_user.username) or "ADMIN🐧"
-                set_staff_gold_by_user_id(
-                    user_id,
-                    staff_level=staff_level,
-                    staff_discount=staff_discount_for_user(user_id),
-                    username=call.from_user.username,
-                    first_name=call.from_user.first_name,
-                    last_name=call.from_user.last_name,
-                )
-            else:
-                # If a user was previously staff and got demoted, drop staff card and
-                # recalculate their LEVEL from visits.
-                clear_staff_gold_by_user_id(user_id)
-        inc_click(user_id)
+    # If a broadcast flow is pending and user navigates anywhere outside broadcast UI,
+    # cancel it immediately. This prevents "stuck" broadcast state from swallowing input.
+    if chat_id in _pending_broadcast and not data.strip().startswith("admin_broadcast"):
+        _pending_broadcast.pop(chat_id, None)
+        _save_pending_broadcast()
+
+    if user:
+        _track_user(user)
         # Global UI action counter (used for "Топ экранов"), only for non-staff users.
         try:
-            if call.from_user and not _is_staff(call.from_user):
-                base = (call.data or "").split(":", 1)[0]
-                # Exclude navigation actions: we track only meaningful screens.
-                if base not in {"back_to_main", "admin_menu", "admin_stats_noop"}:
-                    inc_action(base)
+            base = data.split(":", 1)[0]
+            # Exclude navigation actions: we track only meaningful screens.
+            if base not in {"back_to_main", "admin_menu", "admin_stats_noop"} and not _is_staff(user):
+                inc_action(base)
         except Exception:
             pass
-    except Exception:
-        # If we can't compute a key, still allow processing once.
-        return True
-
     return True
 
 
@@ -1578,58 +1964,14 @@ def _message_guard(message: telebot.types.Message, window_s: float = 2.0) -> boo
     Prevent duplicate handling of the same incoming message/update.
     This fixes double responses when Telegram/client retries or polling restarts.
     """
-    try:
-        key = (message.chat.id, message.message_id)
-        now = time.time()
-        last = _recent_message_keys.get(key, 0.0)
-        if now - last < window_s:
-            return False
-        _recent_message_keys[key] = now
-        # Cheap bound to avoid unbounded growth.
-        if len(_recent_message_keys) > 5000:
-            cutoff = now - 60.0
-            for k, ts in list(_recent_message_keys.items()):
-                if ts < cutoff:
-                    _recent_message_keys.pop(k, None)
-    except Exception:
-        return True
-    try:
-        if message.from_user:
-            touch_user(
-                UserInfo(
-                    user_id=message.from_user.id,
-                    first_name=message.from_user.first_name,
-                    last_name=message.from_user.last_name,
-                    username=message.from_user.username,
-                )
-            )
-            sync_from_user(
-                message.from_user.id,
-                message.from_user.username,
-                message.from_user.first_name,
-                message.from_user.last_name,
-            )
-            # Staff accounts always have a dedicated staff card (no visits are added by this).
-            if _is_staff(message.from_user):
-                staff_level = _staff_level_label(message.from_user.id, message.from_user.username) or "ADMIN🐧"
-                set_staff_gold_by_user_id(
-                    message.from_user.id,
-                    staff_level=staff_level,
-                    staff_discount=staff_discount_for_user(message.from_user.id),
-                    username=message.from_user.username,
-                    first_name=message.from_user.first_name,
-                    last_name=message.from_user.last_name,
-                )
-            else:
-                # If a user was previously staff and got demoted, drop staff card and
-                # recalculate their LEVEL from visits.
-                clear_staff_gold_by_user_id(message.from_user.id)
-            inc_click(message.from_user.id)
-    except Exception:
-        pass
+    if _recent_message_keys.seen_within((message.chat.id, message.message_id), window_s):
+        return False
+    if message.from_user:
+        _track_user(message.from_user)
     return True
 
 
+@lru_cache(maxsize=1024)
 def _admin_label(username: str, first_name: str | None, last_name: str | None) -> str:
     """
     Button labels can't be HTML. Prefer real name if we have it, but always keep @username.
@@ -1738,7 +2080,48 @@ def admin_viewid_paged_keyboard(user_id: int, *, offset: int, total: int, page_s
     return keyboard
 
 
+def _ack_typing(chat_id: int) -> None:
+    # Instant "typing..." indicator while we crunch stats before the real reply.
+    try:
+        bot.send_chat_action(chat_id, "typing")
+    except Exception:
+        pass
+
+
+def _admin_marked_client_line(row: dict) -> str:
+    uid = int(row["user_id"])
+    stats = get_user_stats(uid) or {}
+    uname = stats.get("username")
+    if isinstance(uname, str):
+        uname = uname.strip().lstrip("@") or None
+    else:
+        uname = None
+    label = escape(str(stats.get("first_name") or uname or uid))
+    card = find_card_by_user_id(uid)
+    card_s = f" — карта <b>{escape(card.card_number)}</b>" if card else ""
+    return f'• <a href="{_tg_user_link(uid, uname)}">{label}</a>{card_s}'
+
+
+def _admin_visits_block(admin_id: int, *, offset: int) -> tuple[str, int]:
+    """Rating + recent marked clients section shared by both admin views."""
+    v_today, v_7, v_30, v_total = admin_marked_visits_summary(admin_id, source=BOT_SOURCE)
+    recent, total = admin_marked_recent_clients_page(admin_id, source=BOT_SOURCE, offset=offset, limit=20)
+    rows = "\n".join(_admin_marked_client_line(row) for row in recent) if recent else "Нет данных."
+    text = (
+        "<b>Рейтинг</b>\n"
+        f"Визитов за сегодня: <b>{v_today}</b>\n"
+        f"Визитов за 7 дней: <b>{v_7}</b>\n"
+        f"Визитов за 30 дней: <b>{v_30}</b>\n"
+        f"Всего визитов: <b>{v_total}</b>\n"
+        "\n"
+        "<b>Последние отмеченные</b>\n"
+        f"{rows}"
+    )
+    return (text, total)
+
+
 def _send_admin_view(chat_id: int, *, username: str, offset: int = 0) -> None:
+    _ack_typing(chat_id)
     rec = next((r for r in list_admins() if r.username == username), None)
     if rec is None:
         bot.send_message(
@@ -1749,59 +2132,25 @@ def _send_admin_view(chat_id: int, *, username: str, offset: int = 0) -> None:
         return
 
     name = " ".join([x for x in [(rec.first_name or "").strip(), (rec.last_name or "").strip()] if x]).strip()
-    lines: list[str] = []
-    lines.append("<b>Админ</b>")
-    lines.append("")
-    if name:
-        lines.append(f"Имя: <b>{escape(name)}</b>")
-    lines.append(f"Ник: <b>@{escape(rec.username)}</b>")
+    name_s = f"Имя: <b>{escape(name)}</b>\n" if name else ""
+    header = f"<b>Админ</b>\n\n{name_s}Ник: <b>{_at_username(rec.username)}</b>"
 
     total = 0
     if rec.user_id:
-        v_today, v_7, v_30, v_total = admin_marked_visits_summary(int(rec.user_id), source=BOT_SOURCE)
-        lines.append("")
-        lines.append("<b>Рейтинг</b>")
-        lines.append(f"Визитов за сегодня: <b>{v_today}</b>")
-        lines.append(f"Визитов за 7 дней: <b>{v_7}</b>")
-        lines.append(f"Визитов за 30 дней: <b>{v_30}</b>")
-        lines.append(f"Всего визитов: <b>{v_total}</b>")
-
-        lines.append("")
-        lines.append("<b>Последние отмеченные</b>")
-        recent, total = admin_marked_recent_clients_page(int(rec.user_id), source=BOT_SOURCE, offset=offset, limit=20)
-        if not recent:
-            lines.append("Нет данных.")
-        else:
-            for row in recent:
-                uid = int(row["user_id"])
-                stats = get_user_stats(uid) or {}
-                uname = stats.get("username")
-                if isinstance(uname, str):
-                    uname = uname.strip().lstrip("@") or None
-                else:
-                    uname = None
-                label = stats.get("first_name") or uname or str(uid)
-                label = escape(str(label))
-                card = find_card_by_user_id(uid)
-                if card:
-                    lines.append(
-                        f'• <a href="{_tg_user_link(uid, uname)}">{label}</a> — карта <b>{escape(card.card_number)}</b>'
-                    )
-                else:
-                    lines.append(f'• <a href="{_tg_user_link(uid, uname)}">{label}</a>')
+        block, total = _admin_visits_block(int(rec.user_id), offset=offset)
     else:
-        lines.append("")
-        lines.append("Нет данных: админ ещё не писал боту (user_id неизвестен).")
+        block = "Нет данных: админ ещё не писал боту (user_id неизвестен)."
 
     bot.send_message(
         chat_id,
-        "\n".join(lines),
+        f"{header}\n\n{block}",
         reply_markup=admin_view_paged_keyboard(rec.username, offset=offset, total=total),
         disable_web_page_preview=True,
     )
 
 
 def _send_admin_view_by_id(chat_id: int, *, user_id: int, offset: int = 0) -> None:
+    _ack_typing(chat_id)
     uid = int(user_id)
     stats = get_user_stats(uid) or {}
     uname = stats.get("username")
@@ -1814,51 +2163,13 @@ def _send_admin_view_by_id(chat_id: int, *, user_id: int, offset: int = 0) -> No
     last = (stats.get("last_name") or "").strip()
     name = " ".join([x for x in [first, last] if x]).strip()
 
-    lines: list[str] = []
-    lines.append("<b>Админ</b>")
-    lines.append("")
-    if name:
-        lines.append(f"Имя: <b>{escape(name)}</b>")
-    if uname:
-        lines.append(f"Ник: <b>@{escape(uname)}</b>")
-    else:
-        lines.append(f"ID: <b>{uid}</b>")
-
-    v_today, v_7, v_30, v_total = admin_marked_visits_summary(uid, source=BOT_SOURCE)
-    lines.append("")
-    lines.append("<b>Рейтинг</b>")
-    lines.append(f"Визитов за сегодня: <b>{v_today}</b>")
-    lines.append(f"Визитов за 7 дней: <b>{v_7}</b>")
-    lines.append(f"Визитов за 30 дней: <b>{v_30}</b>")
-    lines.append(f"Всего визитов: <b>{v_total}</b>")
-
-    lines.append("")
-    lines.append("<b>Последние отмеченные</b>")
-    recent, total = admin_marked_recent_clients_page(uid, source=BOT_SOURCE, offset=offset, limit=20)
-    if not recent:
-        lines.append("Нет данных.")
-    else:
-        for row in recent:
-            cuid = int(row["user_id"])
-            cstats = get_user_stats(cuid) or {}
-            cuname = cstats.get("username")
-            if isinstance(cuname, str):
-                cuname = cuname.strip().lstrip("@") or None
-            else:
-                cuname = None
-            clabel = cstats.get("first_name") or cuname or str(cuid)
-            clabel = escape(str(clabel))
-            card = find_card_by_user_id(cuid)
-            if card:
-                lines.append(
-                    f'• <a href="{_tg_user_link(cuid, cuname)}">{clabel}</a> — карта <b>{escape(card.card_number)}</b>'
-                )
-            else:
-                lines.append(f'• <a href="{_tg_user_link(cuid, cuname)}">{clabel}</a>')
+    name_s = f"Имя: <b>{escape(name)}</b>\n" if name else ""
+    ident_s = f"Ник: <b>{_at_username(uname)}</b>" if uname else f"ID: <b>{uid}</b>"
+    block, total = _admin_visits_block(uid, offset=offset)
 
     bot.send_message(
         chat_id,
-        "\n".join(lines),
+        f"<b>Админ</b>\n\n{name_s}{ident_s}\n\n{block}",
         reply_markup=admin_viewid_paged_keyboard(uid, offset=offset, total=total),
         disable_web_page_preview=True,
     )
@@ -1881,7 +2192,8 @@ def send_main_menu(chat_id: int, *, user: telebot.types.User | None) -> None:
     if image_path.exists():
         global _main_menu_photo_file_id
         # Keep chat cleaner: remove previously sent main-menu photo before posting a new one.
-        prev_mid = _main_menu_message_id_by_chat.get(chat_id)
+        # pop(): each old menu message costs at most one delete call, even if the new send fails.
+        prev_mid = _main_menu_message_id_by_chat.pop(chat_id, None)
         if prev_mid:
             try:
                 bot.delete_message(chat_id, prev_mid)
@@ -1931,20 +2243,26 @@ def user_display_name(user: telebot.types.User | None) -> str:
     return "Гость"
 
 
+# Telegram username: 5-32 latin letters/digits/_.
+_USERNAME_RE = re.compile(r"[A-Za-z0-9_]{5,32}")
+_INLINE_AT_USERNAME_RE = re.compile(r"@([A-Za-z0-9_]{5,32})")
+_INLINE_LINK_USERNAME_RE = re.compile(r"(?:https?://)?(?:t\.me|telegram\.me)/([A-Za-z0-9_]{5,32})", re.IGNORECASE)
+
+
 def _extract_username_from_inline_query(text: str) -> str | None:
     s = (text or "").strip()
     if not s:
         return None
     # Accept "@name", "t.me/name", "https://t.me/name", "telegram.me/name"
     s = s.replace("\n", " ").strip()
-    m = re.search(r"@([A-Za-z0-9_]{5,32})", s)
+    m = _INLINE_AT_USERNAME_RE.search(s)
     if m:
         return m.group(1)
-    m = re.search(r"(?:https?://)?(?:t\.me|telegram\.me)/([A-Za-z0-9_]{5,32})", s, flags=re.IGNORECASE)
+    m = _INLINE_LINK_USERNAME_RE.search(s)
     if m:
         return m.group(1)
     # If user typed just the username without @
-    if re.fullmatch(r"[A-Za-z0-9_]{5,32}", s):
+    if _USERNAME_RE.fullmatch(s):
         return s
     return None
 
@@ -1987,7 +2305,7 @@ def level_card_inline_text(*, username: str, user_id: int) -> str:
     medals_line = f"Всего медалей: {medals}\n" if medals else ""
     u = username.strip().lstrip("@")
     return (
-        f"<b>КАРТА LEVEL</b> <b>@{escape(u)}</b>\n\n"
+        f"<b>КАРТА LEVEL</b> <b>{_at_username(u)}</b>\n\n"
         f"Уровень: <b>{escape(str(level_label))}</b>\n"
         f"Номер карты: <b>{escape(str(card_number))}</b>\n\n"
         f"Всего визитов: <b>{int(vtotal)}</b>\n"
@@ -2001,14 +2319,16 @@ def level_card_inline_text(*, username: str, user_id: int) -> str:
 def send_level_menu(chat_id: int, user: telebot.types.User | None, user_id: int | None) -> None:
     display_name = user_display_name(user)
     if user_id is not None and is_registered(user_id):
-        ensure_level_card(
-            user_id,
-            username=(user.username if user else None),
-            first_name=(user.first_name if user else None),
-            last_name=(user.last_name if user else None),
-        )
-        # If this is staff, ensure their card is a staff card in DB too.
-        _ensure_staff_card(user)
+        # One load and one save for both card updates.
+        with card_transaction():
+            ensure_level_card(
+                user_id,
+                username=(user.username if user else None),
+                first_name=(user.first_name if user else None),
+                last_name=(user.last_name if user else None),
+            )
+            # If this is staff, ensure their card is a staff card in DB too.
+            _ensure_staff_card(user)
         bot.send_message(
             chat_id,
             guest_card_text(display_name, user_id=user_id),
@@ -2088,11 +2408,7 @@ def _level_rating_name(card: LevelCard) -> tuple[str, str | None]:
 
 
 def level_rating_text(*, superadmin: bool) -> str:
-    tz = None
-    try:
-        tz = ZoneInfo("Asia/Tyumen")
-    except Exception:
-        tz = datetime.now().astimezone().tzinfo
+    tz = _TYUMEN_TZ or datetime.now().astimezone().tzinfo
     now = datetime.now(tz)  # type: ignore[arg-type]
 
     # Leaderboard launches from March 1st. Before that, show empty slots.
@@ -2360,7 +2676,7 @@ def handle_version_command(message: telebot.types.Message) -> None:
     _delete_command_message(message)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "main_admin")
+@_cb("main_admin")
 def handle_admin_main(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -2376,7 +2692,7 @@ def handle_admin_main(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_menu")
+@_cb("admin_menu")
 def handle_admin_menu(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -2394,7 +2710,7 @@ def handle_admin_menu(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_stats")
+@_cb("admin_stats")
 def handle_admin_stats(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -2402,6 +2718,7 @@ def handle_admin_stats(call: telebot.types.CallbackQuery) -> None:
         return
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
+    _ack_typing(call.message.chat.id)
 
     _pending_admin_add.discard(call.message.chat.id)
     _pending_visit_add.pop(call.message.chat.id, None)
@@ -2455,7 +2772,7 @@ def _admin_stats_keyboard(
     return kb
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_stats_noop")
+@_cb("admin_stats_noop")
 def handle_admin_stats_noop(call: telebot.types.CallbackQuery) -> None:
     # Keep spinner-free UX; do not modify messages.
     if not _callback_guard(call):
@@ -2464,8 +2781,7 @@ def handle_admin_stats_noop(call: telebot.types.CallbackQuery) -> None:
 
 
 def _admin_stats_base_lines() -> list[str]:
-    visits_today, visits_7, visits_30 = visit_counts(source=BOT_SOURCE)
-    subs_today, subs_7, subs_30 = subscribed_counts()
+    (visits_today, visits_7, visits_30), (subs_today, subs_7, subs_30) = dashboard_counts(source=BOT_SOURCE)
 
     lines: list[str] = []
     lines.append("📊 <b>Статистика</b>")
@@ -2532,11 +2848,54 @@ def _card_tier_counts_and_users() -> tuple[dict[str, int], dict[str, list[LevelC
         users[key].append(c)
 
     # Stable sort by visits (desc), then by card number.
+    # LevelCard fields are already int/str (see _to_card), so a C-level getter is enough.
+    by_visits = attrgetter("visits", "card_number")
     for k in users.keys():
-        users[k].sort(key=lambda c: (int(getattr(c, "visits", 0) or 0), str(getattr(c, "card_number", ""))), reverse=True)
+        users[k].sort(key=by_visits, reverse=True)
     return (counts, users)
 
 
+# Stats "Топ экранов": internal/staff-only actions hidden from the ranking.
+_HIDDEN_ACTION_BASES = frozenset(
+    {
+        # Staff-only / internal navigation.
+        "main_admin",
+        "main_add_visit",
+        "admin_menu",
+        "admin_stats",
+        "admin_stats_view",
+        "admin_stats_noop",
+        "back_to_main",
+        "level_tab",
+        "interior",
+    }
+)
+# Friendly labels for common actions.
+_ACTION_LABELS: dict[str, str] = {
+    "back_to_main": "Домой",
+    "main_guest_card": "Карта LEVEL",
+    "main_menu": "Меню",
+    "main_booking": "Бронь",
+    "main_location": "Найти нас",
+    "location_interior": "Интерьер",
+    "level_rules": "Условия",
+    "level_giveaway": "Розыгрыш",
+    "level_rating": "Рейтинг гостей",
+    "register_card": "Получить карту",
+    "menu_hookah": "Меню: Кальян",
+    "menu_tea": "Меню: Чай",
+    "menu_drinks": "Меню: Напитки",
+    "menu_food": "Меню: Еда",
+    "menu_rules": "Меню: Алкоголь",
+}
+_CARD_TIER_TITLES: dict[str, str] = {
+    "iron": "⚙️ IRON",
+    "bronze": "🥉 BRONZE",
+    "silver": "🥈 SILVER",
+    "gold": "🥇 GOLD",
+}
+
+
 def _admin_cards_list_keyboard(*, tier: str, page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     if has_prev:
@@ -2565,13 +2924,7 @@ def _render_admin_cards_list(*, tier: str, page: int) -> tuple[str, InlineKeyboa
     has_prev = offset > 0
     has_next = (offset + per_page) < total
 
-    title_map = {
-        "iron": "⚙️ IRON",
-        "bronze": "🥉 BRONZE",
-        "silver": "🥈 SILVER",
-        "gold": "🥇 GOLD",
-    }
-    lines = [f"<b>Владельцы карт {title_map.get(tier, tier.upper())}</b> - <b>{int(counts.get(tier, 0))}</b>", ""]
+    lines = [f"<b>Владельцы карт {_CARD_TIER_TITLES.get(tier, tier.upper())}</b> - <b>{int(counts.get(tier, 0))}</b>", ""]
     if not rows:
         lines.append("Нет данных.")
     else:
@@ -2613,7 +2966,7 @@ def _user_visit_events(uid: int, *, source: str | None = None) -> list[dict[str,
         if src_filter and src != src_filter:
             continue
         out.append({"ts": ts, "src": src})
-    out.sort(key=lambda r: str(r.get("ts") or ""), reverse=True)
+    out.sort(key=itemgetter("ts"), reverse=True)
     return out
 
 
@@ -2639,10 +2992,8 @@ def _admin_user_profile_text(uid: int) -> str:
 
     all_events = _user_visit_events(int(uid))
     total_visits = max(int(st.get("visits", 0) or 0), len(all_events))
-    by_src: dict[str, int] = {}
-    for ev in all_events:
-        src = str(ev.get("src") or "lounge").strip().lower() or "lounge"
-        by_src[src] = by_src.get(src, 0) + 1
+    # _user_visit_events() already normalized src.
+    by_src = Counter(ev["src"] for ev in all_events)
 
     full_name = " ".join([x for x in [first, last] if x]).strip()
     if not full_name:
@@ -2655,7 +3006,7 @@ def _admin_user_profile_text(uid: int) -> str:
     lines.append("")
     lines.append(f"<b>{escape(full_name)}</b>")
     if username:
-        lines.append(f'<b><a href="{tg_link}">@{escape(username)}</a></b>')
+        lines.append(f'<b><a href="{tg_link}">{_at_username(username)}</a></b>')
     else:
         lines.append("<b>-</b>")
     lines.append("")
@@ -2701,16 +3052,12 @@ def _render_admin_user_visits(uid: int, *, page: int, source: str | None = None)
     label = _src_label(src or "")
     head = "Все визиты" if not src else f"Визиты: {label}"
     lines = [f"<b>{head}</b> — <b>{total}</b>", ""]
-    tz = _tyumen_now().tzinfo
     for i, ev in enumerate(rows, start=offset + 1):
         raw = str(ev.get("ts") or "")
-        try:
-            dt = datetime.fromisoformat(raw)
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=datetime.now().astimezone().tzinfo)
-            dt = dt.astimezone(tz)
+        dt = _tyumen_dt(raw)
+        if dt is not None:
             ts = f"{dt.day:02d}.{dt.month:02d}.{dt.year:04d} {dt.hour:02d}:{dt.minute:02d}"
-        except Exception:
+        else:
             ts = raw
         lines.append(f"{_rank_prefix(i)}<b>{escape(ts)}</b> - {_src_label(str(ev.get('src') or ''))}")
 
@@ -2749,13 +3096,7 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
         rows = all_rows[offset : offset + per_page]
         has_next = (offset + per_page) < total
 
-        title_map = {
-            "iron": "⚙️ IRON",
-            "bronze": "🥉 BRONZE",
-            "silver": "🥈 SILVER",
-            "gold": "🥇 GOLD",
-        }
-        lines.append(f"<b>Владельцы карт {title_map.get(tier, tier.upper())}</b> - <b>{int(counts.get(tier, 0))}</b>")
+        lines.append(f"<b>Владельцы карт {_CARD_TIER_TITLES.get(tier, tier.upper())}</b> - <b>{int(counts.get(tier, 0))}</b>")
         if not rows:
             lines.append("Нет данных.")
             return (lines, has_prev, has_next)
@@ -2777,7 +3118,6 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
             return (lines, has_prev, has_next)
 
         # Display oldest -> newest within the page so the last subscriber is at the bottom.
-        tz = _tyumen_now().tzinfo
         buf = list(reversed(rows))
         current_date = None
         for row in buf:
@@ -2790,15 +3130,8 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
             name = escape(_display_first_name(uid, fallback_username=username))
 
             raw = row.get("joined_at")
-            dt = None
-            try:
-                dt = datetime.fromisoformat(str(raw)) if raw else None
-            except Exception:
-                dt = None
+            dt = _tyumen_dt(str(raw)) if raw else None
             if dt is not None:
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=datetime.now().astimezone().tzinfo)
-                dt = dt.astimezone(tz)
                 dkey = _fmt_date_ymd(dt)
             else:
                 dkey = "Дата неизвестна"
@@ -2817,7 +3150,6 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
             lines.append("Нет данных.")
             return (lines, has_prev, has_next)
 
-        tz = _tyumen_now().tzinfo
         buf = list(reversed(rows))  # oldest -> newest in page (newest at bottom)
         current_date = None
         for row in buf:
@@ -2831,16 +3163,9 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
             name = escape(_display_first_name(uid, fallback_username=username))
 
             raw = row.get("ts")
-            dt = None
-            try:
-                dt = datetime.fromisoformat(str(raw)) if raw else None
-            except Exception:
-                dt = None
+            dt = _tyumen_dt(str(raw)) if raw else None
             time_s = ""
             if dt is not None:
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=datetime.now().astimezone().tzinfo)
-                dt = dt.astimezone(tz)
                 dkey = _fmt_date_ymd(dt)
                 time_s = f"{dt.hour:02d}:{dt.minute:02d} "
             else:
@@ -2912,24 +3237,11 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
         # Load full ranking once and filter out internal/staff-only actions for readability.
         raw_rows, _raw_total = top_actions_paged(offset=0, limit=1000000)
 
-        hidden_bases = {
-            # Staff-only / internal navigation.
-            "main_admin",
-            "main_add_visit",
-            "admin_menu",
-            "admin_stats",
-            "admin_stats_view",
-            "admin_stats_noop",
-            "back_to_main",
-            "level_tab",
-            "interior",
-        }
-
         filtered: list[dict[str, object]] = []
         for r in raw_rows:
             action = str(r.get("action") or "")
             base = action.split(":", 1)[0]
-            if base.startswith("admin_") or base in hidden_bases:
+            if base.startswith("admin_") or base in _HIDDEN_ACTION_BASES:
                 continue
             filtered.append(r)
 
@@ -2941,31 +3253,12 @@ def _admin_stats_section_lines(*, mode: str, page: int) -> tuple[list[str], bool
             lines.append("Нет данных.")
             return (lines, has_prev, has_next)
 
-        # Friendly labels for common actions.
-        label_map = {
-            "back_to_main": "Домой",
-            "main_guest_card": "Карта LEVEL",
-            "main_menu": "Меню",
-            "main_booking": "Бронь",
-            "main_location": "Найти нас",
-            "location_interior": "Интерьер",
-            "level_rules": "Условия",
-            "level_giveaway": "Розыгрыш",
-            "level_rating": "Рейтинг гостей",
-            "register_card": "Получить карту",
-            "menu_hookah": "Меню: Кальян",
-            "menu_tea": "Меню: Чай",
-            "menu_drinks": "Меню: Напитки",
-            "menu_food": "Меню: Еда",
-            "menu_rules": "Меню: Алкоголь",
-        }
-
         display_rows: list[tuple[str, int]] = []
         for row in rows:
             action = str(row.get("action") or "")
             cnt = int(row.get("count", 0) or 0)
             base = action.split(":", 1)[0]
-            human = label_map.get(base, base)
+            human = _ACTION_LABELS.get(base, base)
             display_rows.append((human, cnt))
 
         for i, (human, cnt) in enumerate(display_rows, start=offset + 1):
@@ -3020,39 +3313,39 @@ def _send_or_edit_admin_stats(call: telebot.types.CallbackQuery, *, mode: str, p
     bot.send_message(call.message.chat.id if call.message else call.from_user.id, text, reply_markup=kb, disable_web_page_preview=True)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_stats_view:"))
-def handle_admin_stats_view(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_stats_view")
+def handle_admin_stats_view(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
         return
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
-    parts = (call.data or "").split(":")
     # admin_stats_view:<mode>:<page>
-    mode = (parts[1] if len(parts) > 1 else "latest").strip() or "latest"
+    parts = arg.split(":")
+    mode = parts[0].strip() or "latest"
     try:
-        page = int(parts[2]) if len(parts) > 2 else 0
+        page = int(parts[1]) if len(parts) > 1 else 0
     except Exception:
         page = 0
     _send_or_edit_admin_stats(call, mode=mode, page=max(page, 0))
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_cards_page:"))
-def handle_admin_cards_view(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_cards_page")
+def handle_admin_cards_view(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
         return
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
-    parts = (call.data or "").split(":")
     # admin_cards_page:<tier>:<page>
-    tier = (parts[1] if len(parts) > 1 else "iron").strip().lower()
+    parts = arg.split(":")
+    tier = parts[0].strip().lower()
     if tier not in {"iron", "bronze", "silver", "gold"}:
         tier = "iron"
     try:
-        page = int(parts[2]) if len(parts) > 2 else 0
+        page = int(parts[1]) if len(parts) > 1 else 0
     except Exception:
         page = 0
     text, kb = _render_admin_cards_list(tier=tier, page=max(page, 0))
@@ -3071,8 +3364,8 @@ def handle_admin_cards_view(call: telebot.types.CallbackQuery) -> None:
         bot.send_message(call.message.chat.id, text, reply_markup=kb, disable_web_page_preview=True)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_user_profile:"))
-def handle_admin_user_profile(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_user_profile")
+def handle_admin_user_profile(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3080,7 +3373,7 @@ def handle_admin_user_profile(call: telebot.types.CallbackQuery) -> None:
     if not _is_staff(call.from_user):
         return
     try:
-        uid = int((call.data or "").split(":", 1)[1])
+        uid = int(arg)
     except Exception:
         return
     text = _admin_user_profile_text(uid)
@@ -3100,8 +3393,8 @@ def handle_admin_user_profile(call: telebot.types.CallbackQuery) -> None:
         bot.send_message(call.message.chat.id, text, reply_markup=kb, disable_web_page_preview=True)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_user_visits:"))
-def handle_admin_user_visits(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_user_visits")
+def handle_admin_user_visits(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3109,16 +3402,16 @@ def handle_admin_user_visits(call: telebot.types.CallbackQuery) -> None:
     if not _is_staff(call.from_user):
         return
     # admin_user_visits:<uid>:<page>:<source|all>
-    parts = (call.data or "").split(":")
+    parts = arg.split(":")
     try:
-        uid = int(parts[1]) if len(parts) > 1 else 0
+        uid = int(parts[0])
     except Exception:
         uid = 0
     try:
-        page = int(parts[2]) if len(parts) > 2 else 0
+        page = int(parts[1]) if len(parts) > 1 else 0
     except Exception:
         page = 0
-    src = parts[3] if len(parts) > 3 else ""
+    src = parts[2] if len(parts) > 2 else ""
     if src == "all":
         src = ""
     if uid <= 0:
@@ -3139,7 +3432,7 @@ def handle_admin_user_visits(call: telebot.types.CallbackQuery) -> None:
         bot.send_message(call.message.chat.id, text, reply_markup=kb, disable_web_page_preview=True)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_broadcast")
+@_cb("admin_broadcast")
 def handle_admin_broadcast(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3157,7 +3450,7 @@ def handle_admin_broadcast(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_broadcast_create")
+@_cb("admin_broadcast_create")
 def handle_admin_broadcast_create(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3176,8 +3469,8 @@ def handle_admin_broadcast_create(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_broadcast_root:"))
-def handle_admin_broadcast_root(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_broadcast_root")
+def handle_admin_broadcast_root(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3185,7 +3478,7 @@ def handle_admin_broadcast_root(call: telebot.types.CallbackQuery) -> None:
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    action = (call.data or "").split(":", 1)[1].strip()
+    action = arg.strip()
     _pending_broadcast.pop(call.message.chat.id, None)
     _save_pending_broadcast()
 
@@ -3229,15 +3522,15 @@ def handle_admin_broadcast_root(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_broadcast_inactive:"))
-def handle_admin_broadcast_inactive(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_broadcast_inactive")
+def handle_admin_broadcast_inactive(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
         return
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
-    days_raw = (call.data or "").split(":", 1)[1].strip()
+    days_raw = arg.strip()
     try:
         days = int(days_raw)
     except Exception:
@@ -3254,8 +3547,8 @@ def handle_admin_broadcast_inactive(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_broadcast_inactive_range:"))
-def handle_admin_broadcast_inactive_range(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_broadcast_inactive_range")
+def handle_admin_broadcast_inactive_range(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3263,7 +3556,7 @@ def handle_admin_broadcast_inactive_range(call: telebot.types.CallbackQuery) ->
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    rest = (call.data or "").split(":", 1)[1].strip()
+    rest = arg.strip()
     try:
         a, b = rest.split(":", 1)
         min_days = int(a.strip())
@@ -3284,15 +3577,15 @@ def handle_admin_broadcast_inactive_range(call: telebot.types.CallbackQuery) ->
     )
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_broadcast_upgrade:"))
-def handle_admin_broadcast_upgrade(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_broadcast_upgrade")
+def handle_admin_broadcast_upgrade(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
         return
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
-    code = (call.data or "").split(":", 1)[1].strip()
+    code = arg.strip()
     kind = f"upgrade:{code}"
     label, targets = _broadcast_targets(kind)
     _pending_broadcast[call.message.chat.id] = {"kind": kind, "targets": targets, "label": label}
@@ -3305,7 +3598,7 @@ def handle_admin_broadcast_upgrade(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_broadcast_make")
+@_cb("admin_broadcast_make")
 def handle_admin_broadcast_make(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3344,8 +3637,8 @@ def handle_admin_broadcast_make(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_broadcast_aud:"))
-def handle_admin_broadcast_audience(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_broadcast_aud")
+def handle_admin_broadcast_audience(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3354,7 +3647,7 @@ def handle_admin_broadcast_audience(call: telebot.types.CallbackQuery) -> None:
         return
 
     # Backward-compat: old audience picker buttons map to the new "confirm -> create" flow.
-    kind0 = (call.data or "").split(":", 1)[1].strip()
+    kind0 = arg.strip()
     if kind0 == "all":
         kind = "all"
         back_cb = "admin_broadcast"
@@ -3378,7 +3671,7 @@ def handle_admin_broadcast_audience(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_broadcast_cancel")
+@_cb("admin_broadcast_cancel")
 def handle_admin_broadcast_cancel(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3391,7 +3684,7 @@ def handle_admin_broadcast_cancel(call: telebot.types.CallbackQuery) -> None:
     bot.send_message(call.message.chat.id, "Отменено.", reply_markup=admin_broadcast_root_keyboard())
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_broadcast_replace")
+@_cb("admin_broadcast_replace")
 def handle_admin_broadcast_replace(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3420,7 +3713,7 @@ def handle_admin_broadcast_replace(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_broadcast_send")
+@_cb("admin_broadcast_send")
 def handle_admin_broadcast_send(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3476,17 +3769,27 @@ def handle_admin_broadcast_send(call: telebot.types.CallbackQuery) -> None:
 
     sent = 0
     failed = 0
-    for uid in targets:
+    delivered: list[int] = []
+
+    def _record_delivered() -> None:
         try:
-            bot.copy_message(int(uid), int(src_chat_id), int(src_message_id))
+            record_broadcasts_sent(delivered, kind=(kind or "broadcast"), source=BOT_SOURCE)
+        except Exception:
+            pass
+        delivered.clear()
+
+    try:
+        for uid in targets:
             try:
-                record_broadcast_sent(int(uid), kind=(kind or "broadcast"), source=BOT_SOURCE)
+                bot.copy_message(int(uid), int(src_chat_id), int(src_message_id))
+                delivered.append(int(uid))
+                sent += 1
             except Exception:
-                pass
-            sent += 1
-        except Exception:
-            failed += 1
-        time.sleep(0.05)
+                failed += 1
+            if len(delivered) >= BROADCAST_RECORD_BATCH:
+                _record_delivered()
+    finally:
+        _record_delivered()
 
     bot.send_message(
         call.message.chat.id,
@@ -3496,8 +3799,9 @@ def handle_admin_broadcast_send(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_rules" or (call.data or "").startswith("admin_rules:"))
-def handle_admin_rules(call: telebot.types.CallbackQuery) -> None:
+@_cb("admin_rules")
+@_cb_prefix("admin_rules")
+def handle_admin_rules(call: telebot.types.CallbackQuery, arg: str = "") -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3505,12 +3809,9 @@ def handle_admin_rules(call: telebot.types.CallbackQuery) -> None:
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    data = call.data or "admin_rules"
-    tab = "points"
-    if ":" in data:
-        _p = data.split(":", 1)[1].strip()
-        if _p in {"points", "visits", "rating", "broadcast", "build"}:
-            tab = _p
+    tab = arg.strip()
+    if tab not in {"points", "visits", "rating", "broadcast", "build"}:
+        tab = "points"
 
     text = admin_rules_text(tab)
     kb = admin_rules_keyboard(tab)
@@ -3533,7 +3834,7 @@ def handle_admin_rules(call: telebot.types.CallbackQuery) -> None:
         )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_admins")
+@_cb("admin_admins")
 def handle_admin_admins(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3551,7 +3852,7 @@ def handle_admin_admins(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_admins_list")
+@_cb("admin_admins_list")
 def handle_admin_admins_list(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3568,7 +3869,7 @@ def handle_admin_admins_list(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_admins_add")
+@_cb("admin_admins_add")
 def handle_admin_admins_add(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3585,7 +3886,7 @@ def handle_admin_admins_add(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.message_handler(func=lambda m: m.chat is not None and m.chat.id in _pending_admin_add)
+@bot.message_handler(func=lambda m, _p=_pending_admin_add: m.chat is not None and m.chat.id in _p)
 def handle_admin_add_input(message: telebot.types.Message) -> None:
     if not _message_guard(message):
         return
@@ -3595,7 +3896,7 @@ def handle_admin_add_input(message: telebot.types.Message) -> None:
     text = (message.text or "").strip()
     username = normalize_username(text)
     # Telegram username: 5-32 chars, latin letters/digits/_ (keep it strict).
-    if not (5 <= len(username) <= 32) or not all((c.isalnum() or c == "_") for c in username):
+    if not _USERNAME_RE.fullmatch(username):
         bot.send_message(message.chat.id, "Нужен корректный <b>@username</b>, например <code>@novopaha89</code>.")
         return
 
@@ -3608,10 +3909,9 @@ def handle_admin_add_input(message: telebot.types.Message) -> None:
             set_staff_gold_by_user_id(uid, staff_level="ADMIN🐧", staff_discount=staff_discount_for_user(uid), username=username)
     except Exception:
         pass
-    bot.send_message(message.chat.id, f"Готово. Добавил админа: <b>@{escape(username)}</b>")
     bot.send_message(
         message.chat.id,
-        "<b>Админы</b>",
+        f"Готово. Добавил админа: <b>{_at_username(username)}</b>\n\n<b>Админы</b>",
         reply_markup=admins_list_keyboard("admin_admins"),
         disable_web_page_preview=True,
     )
@@ -3629,11 +3929,12 @@ def handle_admin_add_input(message: telebot.types.Message) -> None:
         "sticker",
     ],
     # If other input flows are active (add-visit / add-admin), don't let broadcast capture the message.
-    func=lambda m: (
+    # _pending_broadcast is rebound on reload, so it stays a global lookup.
+    func=lambda m, _v=_pending_visit_add, _a=_pending_admin_add: (
         m.chat is not None
         and m.chat.id in _pending_broadcast
-        and m.chat.id not in _pending_visit_add
-        and m.chat.id not in _pending_admin_add
+        and m.chat.id not in _v
+        and m.chat.id not in _a
     ),
 )
 def handle_admin_broadcast_text(message: telebot.types.Message) -> None:
@@ -3698,7 +3999,7 @@ def handle_admin_broadcast_text(message: telebot.types.Message) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data in {"admin_add_visit", "admin_add_visit_admins"})
+@_cb("admin_add_visit", "admin_add_visit_admins")
 def handle_admin_add_visit(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3721,7 +4022,7 @@ def handle_admin_add_visit(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.message_handler(func=lambda m: m.chat is not None and m.chat.id in _pending_visit_add)
+@bot.message_handler(func=lambda m, _p=_pending_visit_add: m.chat is not None and m.chat.id in _p)
 def handle_admin_visit_input(message: telebot.types.Message) -> None:
     if not _message_guard(message):
         return
@@ -3760,12 +4061,10 @@ def handle_admin_visit_input(message: telebot.types.Message) -> None:
         )
         return
 
-    if not can_add_visit_today_tyumen(card.user_id, source=BOT_SOURCE):
+    if not add_visit_marked_if_allowed(card.user_id, admin_id, source=BOT_SOURCE):
         _pending_visit_add.pop(message.chat.id, None)
         # Discount should still be shown even if visit can't be counted.
-        current = find_card_by_user_id(card.user_id)
-        base_discount = current.discount if current is not None else card.discount
-        discount, _bonus = total_discount_for_user(card.user_id, int(base_discount))
+        discount, _bonus = total_discount_for_user(card.user_id, int(card.discount))
         bot.send_message(
             message.chat.id,
             f"Сегодня уже визит был засчитан.\nМаксимум один визит в день.\nСкидка <b>{discount}%</b>",
@@ -3774,7 +4073,6 @@ def handle_admin_visit_input(message: telebot.types.Message) -> None:
         )
         return
 
-    add_visit_marked(card.user_id, admin_id, source=BOT_SOURCE)
     # Keep a simple total counter on the client card, too.
     prev_visits = int(getattr(card, "visits", 0) or 0)
     updated = add_visit_by_user_id(card.user_id, 1)
@@ -3793,8 +4091,8 @@ def handle_admin_visit_input(message: telebot.types.Message) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_view:"))
-def handle_admin_view(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_view")
+def handle_admin_view(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3802,13 +4100,12 @@ def handle_admin_view(call: telebot.types.CallbackQuery) -> None:
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    username = (call.data or "").split(":", 1)[1].strip()
-    username = normalize_username(username)
+    username = normalize_username(arg)
     _send_admin_view(call.message.chat.id, username=username, offset=0)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_viewid:"))
-def handle_admin_viewid(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_viewid")
+def handle_admin_viewid(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3817,14 +4114,14 @@ def handle_admin_viewid(call: telebot.types.CallbackQuery) -> None:
         return
 
     try:
-        uid = int((call.data or "").split(":", 1)[1].strip())
+        uid = int(arg.strip())
     except Exception:
         return
     _send_admin_view_by_id(call.message.chat.id, user_id=uid, offset=0)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_viewp:"))
-def handle_admin_view_paged(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_viewp")
+def handle_admin_view_paged(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3832,19 +4129,19 @@ def handle_admin_view_paged(call: telebot.types.CallbackQuery) -> None:
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    parts = (call.data or "").split(":", 2)
-    if len(parts) != 3:
+    parts = arg.split(":", 1)
+    if len(parts) != 2:
         return
-    username = normalize_username(parts[1])
+    username = normalize_username(parts[0])
     try:
-        offset = int(parts[2])
+        offset = int(parts[1])
     except Exception:
         offset = 0
     _send_admin_view(call.message.chat.id, username=username, offset=offset)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_viewidp:"))
-def handle_admin_viewid_paged(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_viewidp")
+def handle_admin_viewid_paged(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3852,22 +4149,22 @@ def handle_admin_viewid_paged(call: telebot.types.CallbackQuery) -> None:
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    parts = (call.data or "").split(":", 2)
-    if len(parts) != 3:
+    parts = arg.split(":", 1)
+    if len(parts) != 2:
         return
     try:
-        uid = int(parts[1])
+        uid = int(parts[0])
     except Exception:
         return
     try:
-        offset = int(parts[2])
+        offset = int(parts[1])
     except Exception:
         offset = 0
     _send_admin_view_by_id(call.message.chat.id, user_id=uid, offset=offset)
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("admin_demote:"))
-def handle_admin_demote(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("admin_demote")
+def handle_admin_demote(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
@@ -3875,8 +4172,7 @@ def handle_admin_demote(call: telebot.types.CallbackQuery) -> None:
     if not is_superadmin(call.from_user.id if call.from_user else None):
         return
 
-    username = (call.data or "").split(":", 1)[1].strip()
-    username = normalize_username(username)
+    username = normalize_username(arg)
     # Try resolve user_id before removing.
     uid = None
     try:
@@ -3896,18 +4192,13 @@ def handle_admin_demote(call: telebot.types.CallbackQuery) -> None:
 
     bot.send_message(
         call.message.chat.id,
-        f"Разжаловал: <b>@{escape(username)}</b>",
-        disable_web_page_preview=True,
-    )
-    bot.send_message(
-        call.message.chat.id,
-        "<b>Админы</b>",
+        f"Разжаловал: <b>{_at_username(username)}</b>\n\n<b>Админы</b>",
         reply_markup=admins_list_keyboard("admin_admins"),
         disable_web_page_preview=True,
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "main_guest_card")
+@_cb("main_guest_card")
 def handle_guest_card(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3919,15 +4210,15 @@ def handle_guest_card(call: telebot.types.CallbackQuery) -> None:
     except Exception as e:
         bot.send_message(call.message.chat.id, f"Ошибка при открытии LEVEL: <code>{escape(str(e))}</code>")
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("level_tab:"))
-def handle_level_tab(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("level_tab")
+def handle_level_tab(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
         return
     user_id = call.from_user.id if call.from_user else None
     registered = bool(user_id is not None and is_registered(user_id))
-    tab = (call.data or "").split(":", 1)[1].strip()
+    tab = arg.strip()
     if tab not in {"card", "rating", "visits", "giveaway"}:
         tab = "card"
 
@@ -3960,14 +4251,14 @@ def handle_level_tab(call: telebot.types.CallbackQuery) -> None:
         )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "main_location")
+@_cb("main_location")
 def handle_location(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
     send_location_menu(call.message.chat.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "location_interior")
+@_cb("location_interior")
 def handle_location_interior(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3976,7 +4267,7 @@ def handle_location_interior(call: telebot.types.CallbackQuery) -> None:
     send_interior(call.message.chat.id, idx=1)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "location_telegram_geo")
+@_cb("location_telegram_geo")
 def handle_location_telegram_geo(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -3988,14 +4279,14 @@ def handle_location_telegram_geo(call: telebot.types.CallbackQuery) -> None:
         bot.send_message(call.message.chat.id, f"Не удалось отправить геолокацию: <code>{escape(str(e))}</code>")
 
 
-@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("interior:"))
-def handle_interior_nav(call: telebot.types.CallbackQuery) -> None:
+@_cb_prefix("interior")
+def handle_interior_nav(call: telebot.types.CallbackQuery, arg: str) -> None:
     if not _callback_guard(call):
         return
     if call.message is None:
         return
     try:
-        idx = int((call.data or "").split(":", 1)[1].strip())
+        idx = int(arg.strip())
     except Exception:
         idx = 1
 
@@ -4006,13 +4297,28 @@ def handle_interior_nav(call: telebot.types.CallbackQuery) -> None:
         return
 
     try:
-        media = telebot.types.InputMediaPhoto(telebot.types.InputFile(p))
-        bot.edit_message_media(
-            media,
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=kb,
-        )
+        file_id = _cached_photo_file_id(p)
+        try:
+            msg = bot.edit_message_media(
+                telebot.types.InputMediaPhoto(file_id or telebot.types.InputFile(p)),
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=kb,
+            )
+        except apihelper.ApiTelegramException as e:
+            if not (file_id and _is_bad_file_id_error(e)):
+                raise
+            # Stale file_id: drop it and upload the file once.
+            _forget_photo_file_id(p)
+            file_id = None
+            msg = bot.edit_message_media(
+                telebot.types.InputMediaPhoto(telebot.types.InputFile(p)),
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=kb,
+            )
+        if not file_id:
+            _remember_photo_file_id(p, msg)
     except Exception as e:
         # Ignore "message is not modified" to prevent spam on repeated taps.
         if "message is not modified" in str(e).lower():
@@ -4025,7 +4331,7 @@ def handle_interior_nav(call: telebot.types.CallbackQuery) -> None:
         send_interior(call.message.chat.id, idx=idx)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "interior_back")
+@_cb("interior_back")
 def handle_interior_back(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -4037,7 +4343,7 @@ def handle_interior_back(call: telebot.types.CallbackQuery) -> None:
         pass
     send_location_menu(call.message.chat.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "main_add_visit")
+@_cb("main_add_visit")
 def handle_main_add_visit(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -4056,7 +4362,7 @@ def handle_main_add_visit(call: telebot.types.CallbackQuery) -> None:
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "main_menu")
+@_cb("main_menu")
 def handle_menu(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -4067,11 +4373,106 @@ def handle_menu(call: telebot.types.CallbackQuery) -> None:
     send_food_menu(call.message.chat.id)
 
 
-@bot.callback_query_handler(
-    func=lambda call: (
-        (call.data in {"menu_hookah", "menu_tea", "menu_drinks", "menu_food", "menu_watch", "menu_rules"})
-    )
+_MENU_SECTION_TEXTS: dict[str, str] = {
+    "menu_hookah": (
+        "<b>КАЛЬЯН</b>\n\n"
+        "<b>До 17:00 - 1 000₽</b>\n"
+        "<b>После 17:00 - 1 400₽</b>\n\n"
+        "Подберём вкус и крепость под тебя\n"
+        "Собираем дымно и надолго\n\n"
+        "Если за столом более 4 гостей - \n"
+        "заказ от 2 кальянов\n"
+        "Если более 6 гостей - от 3 кальянов\n\n"
+        "С 19:00 действует правило:\n"
+        "2 часа на один кальян"
+    ),
+    "menu_tea": (
+        "<b>КЛАССИЧЕСКИЙ ЧАЙ</b>\n"
+        "<b>600</b><b>мл</b> / <b>320</b><b>₽</b>\n"
+        "• Ассам\n"
+        "• Эрл Грей\n"
+        "• Зелёный с жасмином\n"
+        "• Каркаде\n"
+        "• Таёжный сбор\n\n"
+        "<b>КИТАЙСКИЙ ЧАЙ</b>\n"
+        "<b>600</b><b>мл</b> / <b>320</b><b>₽</b>\n"
+        "• Сенча (Шу Сян Люй)\n"
+        "• Молочный улун\n"
+        "• Дянь хун маофен\n"
+        "• Пуэр шу\n"
+        "• Улун те гуань инь\n\n"
+        "<b>ЧАЙ АВТОРСКИЙ</b>\n"
+        "<b>900</b><b>мл</b> / <b>500</b><b>₽</b>\n"
+        "• Брусника-клюква\n"
+        "• Малина-базилик\n"
+        "• Клюква-можжевельник\n"
+        "• Облепиха\n"
+        "• Апельсин-имбирь"
+    ),
+    "menu_rules": (
+        "Мы предоставляем всё необходимое для комфортного распития: бокалы, лёд, штопор.\n\n"
+        "<b>Пробковый сбор:</b>\n"
+        "Пиво, сидр, медовуха - <b>100 руб/бут</b>\n"
+        "Вино, шампанское - <b>300 руб/бут</b>\n"
+        "Крепкий алко (от 20%) - <b>500 руб/бут</b>\n\n"
+        "Гость <b>несёт ответственность</b> за порчу имущества заведения <b>На Грани</b>"
+    ),
+    "menu_watch": "Раздел «Интерьер» находится в разработке 🚧",
+}
+_MENU_DRINKS_TEXT = (
+    "<b>БЕЗАЛКОГОЛЬНЫЕ НАПИТКИ</b>\n"
+    "• Red Bull <b>355</b><b>мл</b> - <b>300</b><b>₽</b>\n"
+    "• Coca-Cola <b>330</b><b>мл</b> - <b>220</b><b>₽</b>\n\n"
+    "<b>МОРСЫ</b>\n"
+    "<b>250</b><b>мл</b> - <b>120</b><b>₽</b>\n"
+    "• Облепиха\n"
+    "• Клюква\n"
+    "• Брусника\n\n"
+    "<b>АВТОРСКИЕ</b>\n"
+    "<b>400</b><b>мл</b> - <b>290</b><b>₽</b>\n"
+    "<b>1</b><b>л</b> - <b>550</b><b>₽</b>\n"
+    "• Клубника - лемонграсс\n"
+    "• Груша - персик - юдзу\n"
+    "• Манго - маракуйя\n"
+    "• Мохито"
 )
+_MENU_DRINKS_RULES_TEXT = (
+    "К нам нельзя со своими безалкогольными напитками\n\n"
+    "Мы предоставляем всё необходимое для комфортного распития: бокалы, лёд, штопор.\n\n"
+    "Пробковый сбор:\n"
+    "Пиво, сидр, медовуха - 100 руб/бут\n"
+    "Вино, шампанское - 300 руб/бут\n"
+    "Крепкий алкоголь (от 20%) - 500 руб/бут\n\n"
+    "Гость несёт ответственность за порчу имущества заведения На Грани"
+)
+
+
+def _menu_section_text(cb: str, *, show_drinks_rules: bool) -> str:
+    static = _MENU_SECTION_TEXTS.get(cb)
+    if static is not None:
+        return static
+    if cb == "menu_food":
+        bot_username = (os.getenv("BOT_USERNAME", "") or "").strip().lstrip("@")
+        mangal_link = f"https://t.me/{bot_username}?start=mangal_kebab" if bot_username else ""
+        mangal_word = (
+            f'<b><a href="{mangal_link}">МАНГАЛ🔥КЕБАБ</a></b>'
+            if mangal_link
+            else "<b>МАНГАЛ🔥КЕБАБ</b>"
+        )
+        return (
+            "<b>Кухни нет - но голодными не оставим</b>\n\n"
+            "Еду можно заказать у партнёров с быстрой доставкой к нам🚚 <b>Нажми</b> на заведение ниже - откроется меню\n\n"
+            f"{mangal_word}\n\n"
+            "Можно со своей едой 🍔 или заказывай доставку где удобно - мы не против"
+        )
+    if cb == "menu_drinks":
+        if not show_drinks_rules:
+            return f"{_MENU_DRINKS_TEXT}\n\nК нам нельзя со своими безалкогольными напитками"
+        return f"{_MENU_DRINKS_TEXT}\n\n{_MENU_DRINKS_RULES_TEXT}"
+    return "Выбери раздел меню:"
+
+
+@_cb("menu_hookah", "menu_tea", "menu_drinks", "menu_food", "menu_watch", "menu_rules")
 def handle_menu_sections(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -4087,102 +4488,7 @@ def handle_menu_sections(call: telebot.types.CallbackQuery) -> None:
     drinks_rules = False
     section_cb = raw
 
-    def _text(cb: str, *, show_drinks_rules: bool) -> str:
-        if cb == "menu_hookah":
-            return (
-                "<b>КАЛЬЯН</b>\n\n"
-                "<b>До 17:00 - 1 000₽</b>\n"
-                "<b>После 17:00 - 1 400₽</b>\n\n"
-                "Подберём вкус и крепость под тебя\n"
-                "Собираем дымно и надолго\n\n"
-                "Если за столом более 4 гостей - \n"
-                "заказ от 2 кальянов\n"
-                "Если более 6 гостей - от 3 кальянов\n\n"
-                "С 19:00 действует правило:\n"
-                "2 часа на один кальян"
-            )
-        if cb == "menu_tea":
-            return (
-                "<b>КЛАССИЧЕСКИЙ ЧАЙ</b>\n"
-                "<b>600</b><b>мл</b> / <b>320</b><b>₽</b>\n"
-                "• Ассам\n"
-                "• Эрл Грей\n"
-                "• Зелёный с жасмином\n"
-                "• Каркаде\n"
-                "• Таёжный сбор\n\n"
-                "<b>КИТАЙСКИЙ ЧАЙ</b>\n"
-                "<b>600</b><b>мл</b> / <b>320</b><b>₽</b>\n"
-                "• Сенча (Шу Сян Люй)\n"
-                "• Молочный улун\n"
-                "• Дянь хун маофен\n"
-                "• Пуэр шу\n"
-                "• Улун те гуань инь\n\n"
-                "<b>ЧАЙ АВТОРСКИЙ</b>\n"
-                "<b>900</b><b>мл</b> / <b>500</b><b>₽</b>\n"
-                "• Брусника-клюква\n"
-                "• Малина-базилик\n"
-                "• Клюква-можжевельник\n"
-                "• Облепиха\n"
-                "• Апельсин-имбирь"
-            )
-        if cb == "menu_food":
-            bot_username = (os.getenv("BOT_USERNAME", "") or "").strip().lstrip("@")
-            mangal_link = f"https://t.me/{bot_username}?start=mangal_kebab" if bot_username else ""
-            mangal_word = (
-                f'<b><a href="{mangal_link}">МАНГАЛ🔥КЕБАБ</a></b>'
-                if mangal_link
-                else "<b>МАНГАЛ🔥КЕБАБ</b>"
-            )
-            return (
-                "<b>Кухни нет - но голодными не оставим</b>\n\n"
-                "Еду можно заказать у партнёров с быстрой доставкой к нам🚚 <b>Нажми</b> на заведение ниже - откроется меню\n\n"
-                f"{mangal_word}\n\n"
-                "Можно со своей едой 🍔 или заказывай доставку где удобно - мы не против"
-            )
-        if cb == "menu_drinks":
-            base = (
-                "<b>БЕЗАЛКОГОЛЬНЫЕ НАПИТКИ</b>\n"
-                "• Red Bull <b>355</b><b>мл</b> - <b>300</b><b>₽</b>\n"
-                "• Coca-Cola <b>330</b><b>мл</b> - <b>220</b><b>₽</b>\n\n"
-                "<b>МОРСЫ</b>\n"
-                "<b>250</b><b>мл</b> - <b>120</b><b>₽</b>\n"
-                "• Облепиха\n"
-                "• Клюква\n"
-                "• Брусника\n\n"
-                "<b>АВТОРСКИЕ</b>\n"
-                "<b>400</b><b>мл</b> - <b>290</b><b>₽</b>\n"
-                "<b>1</b><b>л</b> - <b>550</b><b>₽</b>\n"
-                "• Клубника - лемонграсс\n"
-                "• Груша - персик - юдзу\n"
-                "• Манго - маракуйя\n"
-                "• Мохито"
-            )
-            if not show_drinks_rules:
-                return f"{base}\n\nК нам нельзя со своими безалкогольными напитками"
-            rules = (
-                "К нам нельзя со своими безалкогольными напитками\n\n"
-                "Мы предоставляем всё необходимое для комфортного распития: бокалы, лёд, штопор.\n\n"
-                "Пробковый сбор:\n"
-                "Пиво, сидр, медовуха - 100 руб/бут\n"
-                "Вино, шампанское - 300 руб/бут\n"
-                "Крепкий алкоголь (от 20%) - 500 руб/бут\n\n"
-                "Гость несёт ответственность за порчу имущества заведения На Грани"
-            )
-            return f"{base}\n\n{rules}"
-        if cb == "menu_rules":
-            return (
-                "Мы предоставляем всё необходимое для комфортного распития: бокалы, лёд, штопор.\n\n"
-                "<b>Пробковый сбор:</b>\n"
-                "Пиво, сидр, медовуха - <b>100 руб/бут</b>\n"
-                "Вино, шампанское - <b>300 руб/бут</b>\n"
-                "Крепкий алко (от 20%) - <b>500 руб/бут</b>\n\n"
-                "Гость <b>несёт ответственность</b> за порчу имущества заведения <b>На Грани</b>"
-            )
-        if cb == "menu_watch":
-            return "Раздел «Интерьер» находится в разработке 🚧"
-        return "Выбери раздел меню:"
-
-    text = _text(section_cb, show_drinks_rules=drinks_rules)
+    text = _menu_section_text(section_cb, show_drinks_rules=drinks_rules)
     kb = menu_inline_keyboard(active=section_cb, drinks_rules=drinks_rules)
 
     try:
@@ -4201,7 +4507,7 @@ def handle_menu_sections(call: telebot.types.CallbackQuery) -> None:
         bot.send_message(call.message.chat.id, text, reply_markup=kb, disable_web_page_preview=True)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "register_card")
+@_cb("register_card")
 def handle_register_card_callback(call: telebot.types.CallbackQuery) -> None:
     user = call.from_user
     if user:
@@ -4218,17 +4524,14 @@ def handle_register_card_callback(call: telebot.types.CallbackQuery) -> None:
 
     bot.send_message(
         call.message.chat.id,
-        "Готово, карта <b>LEVEL</b> зарегистрирована.",
-    )
-    bot.send_message(
-        call.message.chat.id,
-        guest_card_text(user_display_name(call.from_user), user_id=(user.id if user else None)),
+        "Готово, карта <b>LEVEL</b> зарегистрирована.\n\n"
+        + guest_card_text(user_display_name(call.from_user), user_id=(user.id if user else None)),
         reply_markup=guest_card_registered_inline_keyboard(),
         disable_web_page_preview=True,
     )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "back_to_main")
+@_cb("back_to_main")
 def handle_back_callback(call: telebot.types.CallbackQuery) -> None:
     if not _callback_guard(call):
         return
@@ -4238,11 +4541,11 @@ def handle_back_callback(call: telebot.types.CallbackQuery) -> None:
 
 
 @bot.message_handler(
-    func=lambda m: (
+    func=lambda m, _a=_pending_admin_add, _v=_pending_visit_add: (
         not (getattr(m, "text", "") or "").startswith("/")
         and (m.chat is None or m.chat.id not in _pending_broadcast)
-        and (m.chat is None or m.chat.id not in _pending_admin_add)
-        and (m.chat is None or m.chat.id not in _pending_visit_add)
+        and (m.chat is None or m.chat.id not in _a)
+        and (m.chat is None or m.chat.id not in _v)
     )
 )
 def handle_fallback(message: telebot.types.Message) -> None:
@@ -4355,7 +4658,13 @@ def handle_inline_query(query: telebot.types.InlineQuery) -> None:
         return
 
 
+def _handle_sigterm(signum, frame) -> None:
+    # systemd/docker stop: exit normally so atexit hooks flush pending data writes.
+    raise SystemExit(0)
+
+
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     # Keep the bot running even if Telegram API is temporarily unreachable
     # (DNS, network hiccups, etc). Without this, a startup failure in setMyCommands
     # can bring the whole bot down.
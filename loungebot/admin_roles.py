@@ -1,9 +1,13 @@
+import atexit
 import json
+import threading
+import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 DATA_FILE = Path("data/admin_roles.json")
+LIST_CACHE_TTL_S = 30.0
 
 
 @dataclass(frozen=True)
@@ -14,98 +18,251 @@ class AdminRecord:
     last_name: str | None
 
 
-def _load() -> dict[str, Any]:
-    if not DATA_FILE.exists():
-        return {"admins": {}}
+# (built_at monotonic, records). Roster changes only via add/remove/sync below.
+_LIST_CACHE: tuple[float, list[AdminRecord]] = (0.0, [])
+
+
+def _invalidate_list_cache() -> None:
+    global _LIST_CACHE
+    _LIST_CACHE = (0.0, [])
+
+
+# Parsed file kept in memory, keyed by (mtime_ns, size) so edits from outside are still picked up.
+# Mutators change the cached dict in place, so everything touching it holds _LOCK.
+_LOCK = threading.RLock()
+_CACHE: tuple[tuple[int, int] | None, dict[str, Any]] | None = None
+# Reverse index user_id -> username, rebuilt whenever the cached dict is (re)loaded or saved.
+# The forward index is data["admins"] itself (keyed by normalized username).
+_BY_USER_ID: dict[int, str] = {}
+# Frozen copy of the known admin ids, handed out as-is by admin_user_ids().
+_ADMIN_USER_IDS: frozenset[int] = frozenset()
+# Writes are coalesced: _save() marks the cache dirty and a timer flushes it shortly after.
+FLUSH_DELAY_S = 1.0
+_DIRTY = False
+_FLUSH_TIMER: threading.Timer | None = None
+# Serializes flush() calls (timer vs atexit) while the file write itself runs outside _LOCK.
+_FLUSH_LOCK = threading.Lock()
+# Roster mutations not yet on disk, oldest first. If the file is edited on disk under unflushed
+# changes, it is reloaded and these are replayed on top instead of being overwritten by flush().
+_PENDING: list[Callable[[dict[str, Any]], bool]] = []
+
+
+def _file_sig() -> tuple[int, int] | None:
     try:
-        return json.loads(DATA_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-        return {"admins": {}}
+        st = DATA_FILE.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _reindex(data: dict[str, Any]) -> None:
+    global _BY_USER_ID, _ADMIN_USER_IDS
+    by_user_id: dict[int, str] = {}
+    for username, rec in (data.get("admins") or {}).items():
+        if not isinstance(rec, dict) or rec.get("user_id") is None:
+            continue
+        try:
+            by_user_id[int(rec["user_id"])] = username
+        except Exception:
+            continue
+    _BY_USER_ID = by_user_id
+    _ADMIN_USER_IDS = frozenset(by_user_id)
+
+
+def _rebase_pending() -> None:
+    """The file changed on disk under unflushed changes: take its version and replay ours on top."""
+    global _CACHE
+    try:
+        data = json.loads(DATA_FILE.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        # Can't read it right now (or it's gone); keep ours, the next check retries.
+        return
+    sig = _file_sig()
+    for op in _PENDING:
+        try:
+            op(data)
+        except Exception:
+            continue
+    _CACHE = (sig, data)
+    _reindex(data)
+    _invalidate_list_cache()
+
+
+def _load() -> dict[str, Any]:
+    global _CACHE
+    with _LOCK:
+        if _DIRTY and _CACHE is not None:
+            # Unflushed changes are newer than our last read, but not necessarily than the file.
+            if _file_sig() not in (None, _CACHE[0]):
+                _rebase_pending()
+            return _CACHE[1]
+        sig = _file_sig()
+        if sig is None:
+            _CACHE = None
+            _reindex({})
+            return {"admins": {}}
+        if _CACHE is not None and _CACHE[0] == sig:
+            return _CACHE[1]
+        try:
+            data = json.loads(DATA_FILE.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            data = {"admins": {}}
+        _CACHE = (sig, data)
+        _reindex(data)
+        _invalidate_list_cache()
+        return data
+
+
+def _apply(op: Callable[[dict[str, Any]], bool]) -> None:
+    """Run a roster mutation on the cached data; if it changed something (returned True), save it and keep it for replay."""
+    with _LOCK:
+        data = _load()
+        if op(data):
+            _PENDING.append(op)
+            _save(data)
+            _invalidate_list_cache()
 
 
 def _save(data: dict[str, Any]) -> None:
-    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    tmp = DATA_FILE.with_suffix(".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(DATA_FILE)
+    global _CACHE, _DIRTY, _FLUSH_TIMER
+    with _LOCK:
+        _CACHE = (_CACHE[0] if _CACHE is not None else None, data)
+        _reindex(data)
+        _DIRTY = True
+        if _FLUSH_TIMER is None:
+            _FLUSH_TIMER = threading.Timer(FLUSH_DELAY_S, flush)
+            _FLUSH_TIMER.daemon = True
+            _FLUSH_TIMER.start()
+
+
+def flush() -> None:
+    """Write pending roster changes to disk (called by the timer and at exit)."""
+    global _CACHE, _DIRTY, _FLUSH_TIMER
+    with _FLUSH_LOCK:
+        for attempt in range(3):
+            with _LOCK:
+                if _FLUSH_TIMER is not None:
+                    _FLUSH_TIMER.cancel()
+                    _FLUSH_TIMER = None
+                if not _DIRTY or _CACHE is None:
+                    return
+                if _file_sig() not in (None, _CACHE[0]):
+                    _rebase_pending()
+                base_sig, data = _CACHE
+                # Snapshot under the lock; the disk write below doesn't hold up is_admin_user() callers.
+                payload = json.dumps(data, ensure_ascii=False, indent=2)
+                flushed = len(_PENDING)
+                _DIRTY = False
+            try:
+                DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+                tmp = DATA_FILE.with_suffix(".tmp")
+                tmp.write_text(payload, encoding="utf-8")
+                with _LOCK:
+                    # Edited on disk since the snapshot: merge and snapshot again rather than overwrite.
+                    if _file_sig() not in (None, base_sig) and attempt < 2:
+                        _DIRTY = True
+                        continue
+                    tmp.replace(DATA_FILE)
+                    del _PENDING[:flushed]
+                    if _CACHE is not None and _CACHE[1] is data:
+                        # Changes made since the snapshot are still in _PENDING, on top of this file.
+                        _CACHE = (_file_sig(), data)
+                return
+            except Exception:
+                with _LOCK:
+                    _DIRTY = True
+                raise
+
+
+atexit.register(flush)
 
 
 def normalize_username(value: str) -> str:
-    s = value.strip()
-    if s.startswith("@"):  # allow input with @
-        s = s[1:]
-    return s.lower()
+    # Allow input with @.
+    return value.strip().removeprefix("@").lower()
 
 
 def add_admin_by_username(username: str) -> None:
     u = normalize_username(username)
-    data = _load()
-    admins = data.setdefault("admins", {})
-    admins.setdefault(u, {"user_id": None, "first_name": None, "last_name": None})
-    _save(data)
+
+    def op(data: dict[str, Any]) -> bool:
+        admins = data.setdefault("admins", {})
+        if u in admins:
+            return False
+        admins[u] = {"user_id": None, "first_name": None, "last_name": None}
+        return True
+
+    _apply(op)
 
 
 def remove_admin_by_username(username: str) -> None:
     u = normalize_username(username)
-    data = _load()
-    admins = data.setdefault("admins", {})
-    if u in admins:
+
+    def op(data: dict[str, Any]) -> bool:
+        admins = data.setdefault("admins", {})
+        if u not in admins:
+            return False
         admins.pop(u)
-        _save(data)
+        return True
+
+    _apply(op)
 
 
 def list_admins() -> list[AdminRecord]:
-    data = _load()
-    admins: dict[str, Any] = data.get("admins", {})
-    out: list[AdminRecord] = []
-    for username, rec in admins.items():
-        out.append(
-            AdminRecord(
-                username=username,
-                user_id=rec.get("user_id"),
-                first_name=rec.get("first_name"),
-                last_name=rec.get("last_name"),
+    global _LIST_CACHE
+    with _LOCK:
+        data = _load()
+        built_at, cached = _LIST_CACHE
+        if built_at and time.monotonic() - built_at < LIST_CACHE_TTL_S:
+            return list(cached)
+        admins: dict[str, Any] = data.get("admins", {})
+        out: list[AdminRecord] = []
+        for username, rec in admins.items():
+            out.append(
+                AdminRecord(
+                    username=username,
+                    user_id=rec.get("user_id"),
+                    first_name=rec.get("first_name"),
+                    last_name=rec.get("last_name"),
+                )
             )
-        )
-    out.sort(key=lambda r: r.username)
-    return out
+        out.sort(key=lambda r: r.username)
+        _LIST_CACHE = (time.monotonic(), out)
+        return list(out)
 
 
-def admin_user_ids() -> set[int]:
+def admin_user_ids() -> frozenset[int]:
     """
     Returns admin user_ids that we already know (synced from Telegram updates).
     """
-    ids: set[int] = set()
-    for rec in list_admins():
-        if rec.user_id is None:
-            continue
-        try:
-            ids.add(int(rec.user_id))
-        except Exception:
-            continue
-    return ids
+    with _LOCK:
+        _load()
+        return _ADMIN_USER_IDS
 
 
 def sync_from_user(user_id: int, username: str | None, first_name: str | None, last_name: str | None) -> None:
     if not username:
         return
     u = normalize_username(username)
-    data = _load()
-    admins = data.setdefault("admins", {})
-    rec = admins.get(u)
-    if rec is None:
-        return
-    rec["user_id"] = user_id
-    rec["first_name"] = first_name
-    rec["last_name"] = last_name
-    _save(data)
+
+    def op(data: dict[str, Any]) -> bool:
+        rec = data.setdefault("admins", {}).get(u)
+        if rec is None:
+            return False
+        if (rec.get("user_id"), rec.get("first_name"), rec.get("last_name")) == (user_id, first_name, last_name):
+            return False
+        rec["user_id"] = user_id
+        rec["first_name"] = first_name
+        rec["last_name"] = last_name
+        return True
+
+    _apply(op)
 
 
 def is_admin_user(user_id: int, username: str | None) -> bool:
-    if username:
-        u = normalize_username(username)
+    with _LOCK:
         admins = _load().get("admins", {})
-        return u in admins
-    # Fallback by user_id if we already synced.
-    admins = _load().get("admins", {})
-    return any((rec.get("user_id") == user_id) for rec in admins.values())
+        if username:
+            return normalize_username(username) in admins
+        # Fallback by user_id if we already synced.
+        return user_id in _ADMIN_USER_IDS
@@ -1,8 +1,17 @@
+import atexit
+import heapq
 import json
+import os
+import sys
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import lru_cache, wraps
+from operator import itemgetter
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 from zoneinfo import ZoneInfo
 
 DATA_FILE = Path("data/admin_stats.json")
@@ -13,6 +22,53 @@ DATA_FILE = Path("data/admin_stats.json")
 VISIT_LEGACY_SRC = "lounge"
 DEFAULT_BROADCAST_COOLDOWN_DAYS = 7
 _BROADCAST_IGNORE_KINDS = {"contest"}
+# Ranking key for (id, count) pairs: count desc, ties by id desc (C-level, no per-item lambda).
+_COUNT_THEN_ID = itemgetter(1, 0)
+
+# Parsed file kept in memory, keyed by (mtime_ns, size) so writes from the other bot are still picked up.
+# Mutators change the cached dict in place, so every public function runs under _LOCK (see @_locked).
+_LOCK = threading.RLock()
+_CACHE: tuple[tuple[int, int] | None, dict[str, Any]] | None = None
+# Writes are coalesced: _save() marks the cache dirty and a timer flushes it shortly after,
+# so a burst of clicks costs one file rewrite instead of one per event.
+FLUSH_DELAY_S = 2.0
+_DIRTY = False
+_FLUSH_TIMER: threading.Timer | None = None
+# Serializes flush() calls (timer vs atexit) while the file write itself runs outside _LOCK.
+_FLUSH_LOCK = threading.Lock()
+# Mutations not yet on disk, oldest first (see _apply()). The file is shared with the other bot: if it
+# changes under unflushed data, it is reloaded and these are replayed on top instead of overwriting it.
+_PENDING: list[Callable[[dict[str, Any]], Any]] = []
+# Flat view of admin-marked visit events: (admin_id, user_id, src, ts_raw, ts_epoch ms).
+# Built lazily from the cached dict; visit appends extend it in place (_note_visit), a reload drops it.
+_MarkedVisit = tuple[int, int | None, str, str, int | None]
+_MARKED_INDEX: list[_MarkedVisit] | None = None
+# (uid, src or None) -> sorted epoch ms of that user's visit events; filled lazily per user.
+_VISIT_EPOCHS: dict[tuple[str, str | None], list[int]] = {}
+# (admin_id, src or None) -> (sorted epoch ms, total marked incl. events without a timestamp).
+# Built from _MARKED_INDEX in one pass; lets the per-admin windows bisect instead of scanning.
+_ADMIN_EPOCHS: dict[tuple[int, str | None], tuple[list[int], int]] | None = None
+# (admin_id, src or None) -> all-time marked visits, counting every event with `by` (timestamp or not).
+_ADMIN_TOTALS: Counter[tuple[int, str | None]] | None = None
+# Per-record timestamp field ("joined_at", "unsubscribed_at") -> sorted epoch ms over all users,
+# so window counts bisect. Any save or reload drops them (new users, unsubscribes and returns all go
+# through _save()).
+_FIELD_EPOCHS: dict[str, list[int]] = {}
+# Per-user "latest event" aggregates: uid -> {src: latest visit epoch ms} and
+# uid -> latest cooldown-relevant broadcast epoch ms. Filled per user on first use and kept
+# current by the appends; only a reload drops them.
+# Kept in memory rather than on the record: the other bot appends events without updating such fields.
+_LAST_VISIT_MS: dict[str, dict[str, int]] = {}
+_LAST_BROADCAST_MS: dict[str, int | None] = {}
+# (listing, active_only) -> user ids in display order for the paged listings, so paging doesn't
+# re-sort every user. Dropped by anything that adds a user or (un)subscribes. The "visits" listing
+# also keeps a parallel ascending list of (-visits, -user_id) keys, so a marked visit moves the
+# user with two bisects instead of a rebuild.
+_ORDERS: dict[tuple[str, bool], tuple[list[str], list[tuple[int, int]] | None]] = {}
+# Ids of users without `unsubscribed_at`, in file order; dropped together with _ORDERS.
+_ACTIVE_UIDS: list[str] | None = None
+# Normalized username -> user_id (first record wins, like the old linear scan).
+_USERNAME_INDEX: dict[str, int | None] | None = None
 
 
 @dataclass(frozen=True)
@@ -26,7 +82,7 @@ class UserInfo:
 def _now() -> datetime:
     return datetime.now().astimezone()
 
-def _tyumen_tz():
+def _resolve_tyumen_tz():
     # Tyumen time: UTC+5. Try canonical tz names, fallback to fixed offset.
     try:
         return ZoneInfo("Asia/Tyumen")
@@ -38,93 +94,418 @@ def _tyumen_tz():
             return timezone(timedelta(hours=5))
 
 
+# Resolved once: the daily-limit check runs on every visit mark.
+_TYUMEN_TZ = _resolve_tyumen_tz()
+
+
 def _tyumen_window_start(now: datetime) -> datetime:
     """
     Business day boundary: 06:00 Tyumen time.
     Returns start timestamp of the current business day window.
     """
-    tz = _tyumen_tz()
-    local = now.astimezone(tz)
+    local = now if now.tzinfo is _TYUMEN_TZ else now.astimezone(_TYUMEN_TZ)
     start_today = local.replace(hour=6, minute=0, second=0, microsecond=0)
     if local < start_today:
         start_today = start_today - timedelta(days=1)
     return start_today
 
 
+# (start ms, end ms) of the business day last computed; reused until the clock leaves it.
+_TYUMEN_WINDOW_MS: tuple[int, int] = (0, 0)
+
+
+def _tyumen_window_ms(now: datetime) -> tuple[int, int]:
+    global _TYUMEN_WINDOW_MS
+    now_ms = _epoch_ms(now)
+    start_ms, end_ms = _TYUMEN_WINDOW_MS
+    if start_ms <= now_ms < end_ms:
+        return _TYUMEN_WINDOW_MS
+    start = _tyumen_window_start(now)
+    _TYUMEN_WINDOW_MS = (_epoch_ms(start), _epoch_ms(start + timedelta(days=1)))
+    return _TYUMEN_WINDOW_MS
+
+
+@lru_cache(maxsize=100_000)
+def _parse_iso(raw: str) -> datetime | None:
+    # Event timestamps are immutable strings that get rescanned by every stats query.
+    try:
+        return datetime.fromisoformat(raw)
+    except Exception:
+        return None
+
+
 def _parse_event_ts(raw_ts: object, *, fallback_tz) -> datetime | None:
     if not raw_ts:
         return None
-    try:
-        ts = datetime.fromisoformat(str(raw_ts))
-    except Exception:
+    ts = _parse_iso(str(raw_ts))
+    if ts is None:
         return None
     if ts.tzinfo is None:
         ts = ts.replace(tzinfo=fallback_tz)
     return ts
 
 
+def _epoch_ms(ts: datetime) -> int:
+    return int(ts.timestamp() * 1000)
+
+
+def _event_epoch_ms(raw: object, *, fallback_tz) -> int | None:
+    """
+    Visit/broadcast event time as epoch milliseconds.
+    Dict events carry it as `ts_epoch`; legacy ISO-string events are parsed (memoized).
+    """
+    if isinstance(raw, dict):
+        ms = raw.get("ts_epoch")
+        if isinstance(ms, int):
+            return ms
+        raw_ts = raw.get("ts")
+    else:
+        raw_ts = raw
+    ts = _parse_event_ts(raw_ts, fallback_tz=fallback_tz)
+    return None if ts is None else _epoch_ms(ts)
+
+
+def _normalize_loaded(data: dict[str, Any]) -> None:
+    """
+    One-time cleanup of a freshly parsed file, so query loops and mutators can skip defensive checks:
+    user records are always dicts with list `visit_events`/`broadcast_events` and a `last_click_at` key
+    (the same shape _new_user_record() builds), and dict visit events carry an int-or-None `by`,
+    a canonical (stripped, lowercased) or None `src`, and `ts_epoch` (filled in memory here, reaches
+    disk with the next regular save).
+    """
+    users = data.get("users")
+    if not isinstance(users, dict):
+        users = {}
+        data["users"] = users
+    for uid in [uid for uid, rec in users.items() if not isinstance(rec, dict)]:
+        del users[uid]
+    tz = _now().tzinfo
+    for rec in users.values():
+        events = rec.get("visit_events")
+        if not isinstance(events, list):
+            events = []
+            rec["visit_events"] = events
+        for raw in events:
+            if not isinstance(raw, dict):
+                continue
+            src = raw.get("src")
+            if src is not None:
+                src = src.strip().lower() if isinstance(src, str) else ""
+                # Canonical, interned source names let _event_src() skip per-event normalization.
+                raw["src"] = sys.intern(src) if src else None
+            by = raw.get("by")
+            if by is not None and type(by) is not int:
+                try:
+                    raw["by"] = int(by)
+                except Exception:
+                    raw["by"] = None
+            if not isinstance(raw.get("ts_epoch"), int):
+                ms = _event_epoch_ms(raw, fallback_tz=tz)
+                if ms is not None:
+                    raw["ts_epoch"] = ms
+        _ensure_chronological(events, tz=tz)
+        broadcasts = rec.get("broadcast_events")
+        if not isinstance(broadcasts, list):
+            broadcasts = []
+            rec["broadcast_events"] = broadcasts
+        for raw in broadcasts:
+            if isinstance(raw, dict) and not isinstance(raw.get("ts_epoch"), int):
+                ms = _event_epoch_ms(raw, fallback_tz=tz)
+                if ms is not None:
+                    raw["ts_epoch"] = ms
+        rec.setdefault("last_click_at", None)
+
+
+def _ensure_chronological(events: list[Any], *, tz) -> None:
+    """
+    Keep a user's visit_events oldest -> newest (events without a timestamp first), so window
+    scans can walk from the end and stop at the window start. Appends keep the order already;
+    this only does work for lists merged out of order or clock skew.
+    """
+    keys = [_event_epoch_ms(raw, fallback_tz=tz) if raw else None for raw in events]
+    keys = [-1 if k is None else k for k in keys]
+    if all(a <= b for a, b in zip(keys, keys[1:])):
+        return
+    order = sorted(range(len(events)), key=keys.__getitem__)
+    events[:] = [events[i] for i in order]
+
+
 def _event_src(raw: object) -> str:
+    # `src` is canonicalized on load (and written canonical), so no strip/lower here.
     if isinstance(raw, dict):
-        s = raw.get("src")
-        if isinstance(s, str) and s.strip():
-            return s.strip().lower()
+        return raw.get("src") or VISIT_LEGACY_SRC
     # Old format (ISO string) or dict without src.
     return VISIT_LEGACY_SRC
 
 
-def _load() -> dict[str, Any]:
-    if not DATA_FILE.exists():
-        return {"users": {}}
+def _locked(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _LOCK:
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _invalidate_indexes() -> None:
+    global _MARKED_INDEX, _ADMIN_EPOCHS, _ADMIN_TOTALS, _USERNAME_INDEX, _ACTIVE_UIDS
+    _MARKED_INDEX = None
+    _ADMIN_EPOCHS = None
+    _ADMIN_TOTALS = None
+    _FIELD_EPOCHS.clear()
+    _VISIT_EPOCHS.clear()
+    _ORDERS.clear()
+    _ACTIVE_UIDS = None
+    _USERNAME_INDEX = None
+
+
+def _users_changed() -> None:
+    """A user was added or (un)subscribed: listing orders and the active view are rebuilt on next use."""
+    global _ACTIVE_UIDS
+    _ORDERS.clear()
+    _ACTIVE_UIDS = None
+
+
+def _active_uids(data: dict[str, Any]) -> list[str]:
+    global _ACTIVE_UIDS
+    if _ACTIVE_UIDS is None:
+        _ACTIVE_UIDS = [uid for uid, rec in (data.get("users") or {}).items() if not rec.get("unsubscribed_at")]
+    return _ACTIVE_UIDS
+
+
+def _forget_last_events() -> None:
+    _LAST_VISIT_MS.clear()
+    _LAST_BROADCAST_MS.clear()
+
+
+def _norm_username(value: object) -> str:
+    return (str(value or "")).strip().lstrip("@").lower()
+
+
+def _file_sig() -> tuple[int, int] | None:
     try:
-        return json.loads(DATA_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-        return {"users": {}}
+        st = DATA_FILE.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_file() -> tuple[tuple[int, int], dict[str, Any]] | None:
+    try:
+        # Bytes straight into json (it decodes once itself), and the signature is taken from
+        # the handle we actually read, so a concurrent rewrite can't pair new content with an old sig.
+        with DATA_FILE.open("rb") as f:
+            st = os.fstat(f.fileno())
+            raw = f.read()
+        data = json.loads(raw)
+        del raw
+    except (OSError, ValueError):
+        return None
+    _normalize_loaded(data)
+    return ((st.st_mtime_ns, st.st_size), data)
+
+
+def _rebase_pending() -> None:
+    """
+    The file changed on disk while we hold unflushed mutations (the other bot wrote it):
+    take its version and replay ours on top. If it can't be read right now, keep ours; the next check retries.
+    """
+    global _CACHE
+    loaded = _read_file()
+    if loaded is None:
+        return
+    sig, data = loaded
+    _invalidate_indexes()
+    _forget_last_events()
+    for op in _PENDING:
+        try:
+            op(data)
+        except Exception:
+            continue
+    _CACHE = (sig, data)
+
+
+def _load() -> dict[str, Any]:
+    global _CACHE
+    with _LOCK:
+        sig = _file_sig()
+        if _DIRTY and _CACHE is not None:
+            # Unflushed changes are newer than our last read, but not necessarily than the other bot's writes.
+            if sig is not None and sig != _CACHE[0]:
+                _rebase_pending()
+            return _CACHE[1]
+        if sig is None:
+            _CACHE = None
+            _invalidate_indexes()
+            _forget_last_events()
+            return {"users": {}}
+        if _CACHE is not None and _CACHE[0] == sig:
+            return _CACHE[1]
+        loaded = _read_file()
+        if loaded is None:
+            _CACHE = None
+            _invalidate_indexes()
+            _forget_last_events()
+            return {"users": {}}
+        _CACHE = loaded
+        _invalidate_indexes()
+        _forget_last_events()
+        return loaded[1]
+
+
+def _apply(op: Callable[[dict[str, Any]], Any]) -> Any:
+    """
+    Run one mutation on the cached data and schedule a flush. `op` must be replayable (capture the clock
+    outside it); returning False means nothing changed, so it is neither saved nor kept for replay.
+    """
+    data = _load()
+    result = op(data)
+    if result is not False:
+        _PENDING.append(op)
+        _save(data)
+    return result
 
 
 def _save(data: dict[str, Any]) -> None:
-    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    tmp = DATA_FILE.with_suffix(".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(DATA_FILE)
+    global _CACHE, _DIRTY, _FLUSH_TIMER
+    with _LOCK:
+        _CACHE = (_CACHE[0] if _CACHE is not None else None, data)
+        _FIELD_EPOCHS.clear()
+        _DIRTY = True
+        if _FLUSH_TIMER is None:
+            _FLUSH_TIMER = threading.Timer(FLUSH_DELAY_S, flush)
+            _FLUSH_TIMER.daemon = True
+            _FLUSH_TIMER.start()
+
+
+def flush() -> None:
+    """Write pending stats changes to disk (called by the timer and at exit)."""
+    global _CACHE, _DIRTY, _FLUSH_TIMER
+    with _FLUSH_LOCK:
+        for attempt in range(3):
+            with _LOCK:
+                if _FLUSH_TIMER is not None:
+                    _FLUSH_TIMER.cancel()
+                    _FLUSH_TIMER = None
+                if not _DIRTY or _CACHE is None:
+                    return
+                if _file_sig() not in (None, _CACHE[0]):
+                    _rebase_pending()
+                base_sig, data = _CACHE
+                # Serialize under the lock (the dict is mutated in place), but do the disk I/O
+                # outside it so handlers aren't blocked on the write.
+                # Compact output: this file only grows and nobody reads it by hand.
+                payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                flushed = len(_PENDING)
+                _DIRTY = False
+            try:
+                DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+                tmp = DATA_FILE.with_suffix(".tmp")
+                # One fsync per coalesced batch, on the timer thread, so handlers never wait on the disk.
+                # Changes still waiting for the timer are only in memory.
+                with tmp.open("w", encoding="utf-8") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    st = os.fstat(f.fileno())
+                with _LOCK:
+                    # Last check right before the rename: if the other bot wrote meanwhile, merge and retry
+                    # rather than replace its changes (after a few rounds, write what we have).
+                    if _file_sig() not in (None, base_sig) and attempt < 2:
+                        _DIRTY = True
+                        continue
+                    tmp.replace(DATA_FILE)
+                    del _PENDING[:flushed]
+                    if _CACHE is not None and _CACHE[1] is data:
+                        # Whatever was mutated since the dump is still in _PENDING, on top of this file.
+                        _CACHE = ((st.st_mtime_ns, st.st_size), data)
+                return
+            except Exception:
+                with _LOCK:
+                    _DIRTY = True
+                raise
+
+
+atexit.register(flush)
+
+
+def _new_user_record(now: str, **fields: Any) -> dict[str, Any]:
+    """Fresh user record with every key the queries rely on; `fields` override the defaults."""
+    rec: dict[str, Any] = {
+        "first_name": None,
+        "last_name": None,
+        "username": None,
+        "joined_at": now,
+        "last_seen": now,
+        "unsubscribed_at": None,
+        "clicks": 0,
+        "visits": 0,
+        # Confirmed visits timestamps (added by admin actions).
+        "visit_events": [],
+        # For "clicked within last N days" checks.
+        "last_click_at": None,
+        # Sent broadcasts to this user (for rate limiting).
+        "broadcast_events": [],
+    }
+    rec.update(fields)
+    return rec
+
+
+# touch_user() runs on every incoming update; last_seen is only refreshed at this granularity so a
+# chatty user doesn't mark the whole file dirty on each message.
+LAST_SEEN_RESOLUTION_S = 60
 
 
+def _touch_is_noop(rec: dict[str, Any], user: UserInfo, now: datetime) -> bool:
+    if (
+        rec.get("first_name") != user.first_name
+        or rec.get("last_name") != user.last_name
+        or rec.get("username") != user.username
+        or rec.get("unsubscribed_at") is not None
+    ):
+        return False
+    seen = _parse_event_ts(rec.get("last_seen"), fallback_tz=now.tzinfo)
+    return seen is not None and timedelta(0) <= now - seen < timedelta(seconds=LAST_SEEN_RESOLUTION_S)
+
+
+@_locked
 def touch_user(user: UserInfo) -> None:
-    data = _load()
+    now_dt = _now()
+    _apply(lambda data: _touch_user_in(data, user, now_dt))
+
+
+def _touch_user_in(data: dict[str, Any], user: UserInfo, now_dt: datetime) -> bool:
+    global _USERNAME_INDEX
     users = data.setdefault("users", {})
     uid = str(user.user_id)
     rec = users.get(uid)
 
-    now = _now().isoformat()
+    now = now_dt.isoformat()
+    if rec is not None and _touch_is_noop(rec, user, now_dt):
+        return False
+    if rec is None or rec.get("unsubscribed_at"):
+        _users_changed()
     if rec is None:
-        users[uid] = {
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "username": user.username,
-            "joined_at": now,
-            "last_seen": now,
-            "unsubscribed_at": None,
-            "clicks": 0,
-            "visits": 0,
-            # Confirmed visits timestamps (added by admin actions).
-            "visit_events": [],
-            # For "clicked within last N days" checks.
-            "last_click_at": None,
-            # Sent broadcasts to this user (for rate limiting).
-            "broadcast_events": [],
-        }
+        users[uid] = _new_user_record(
+            now, first_name=user.first_name, last_name=user.last_name, username=user.username
+        )
+        u = _norm_username(user.username)
+        if u and _USERNAME_INDEX is not None:
+            # New records go last, so they only win if nobody else has this username.
+            _USERNAME_INDEX.setdefault(u, user.user_id)
     else:
+        if _norm_username(rec.get("username")) != _norm_username(user.username):
+            # Rare; rebuild lazily rather than work out who now owns the old name.
+            _USERNAME_INDEX = None
         rec["first_name"] = user.first_name
         rec["last_name"] = user.last_name
         rec["username"] = user.username
         rec["last_seen"] = now
         # If user came back after block/unblock, treat as subscribed again.
         rec["unsubscribed_at"] = None
-        rec.setdefault("visit_events", [])
-        rec.setdefault("last_click_at", None)
-        rec.setdefault("broadcast_events", [])
-
-    _save(data)
+    return True
 
+@_locked
 def inc_action(action: str) -> None:
     """
     Increment global counter for a UI action (callback_data/command).
@@ -133,40 +514,46 @@ def inc_action(action: str) -> None:
     a = (action or "").strip()
     if not a:
         return
-    data = _load()
-    actions = data.setdefault("actions", {})
-    if not isinstance(actions, dict):
-        actions = {}
-        data["actions"] = actions
-    actions[a] = int(actions.get(a, 0) or 0) + 1
-    _save(data)
+
+    def op(data: dict[str, Any]) -> None:
+        actions = data.setdefault("actions", {})
+        if not isinstance(actions, dict):
+            actions = {}
+            data["actions"] = actions
+        actions[a] = int(actions.get(a, 0) or 0) + 1
+
+    _apply(op)
 
 
-def _last_broadcast_ts(rec: dict[str, Any]) -> datetime | None:
-    events = rec.get("broadcast_events") or []
-    if not isinstance(events, list) or not events:
+def _last_broadcast_ms(uid: str, rec: dict[str, Any]) -> int | None:
+    if uid in _LAST_BROADCAST_MS:
+        return _LAST_BROADCAST_MS[uid]
+    last = _scan_last_broadcast_ms(rec)
+    _LAST_BROADCAST_MS[uid] = last
+    return last
+
+
+def _scan_last_broadcast_ms(rec: dict[str, Any]) -> int | None:
+    events = rec["broadcast_events"]
+    if not events:
         return None
     tz = _now().tzinfo
-    last: datetime | None = None
+    last: int | None = None
     for raw in events:
         if not raw:
             continue
-        kind = None
-        if isinstance(raw, dict):
-            kind = raw.get("kind")
-            raw_ts = raw.get("ts")
-        else:
-            raw_ts = raw
+        kind = raw.get("kind") if isinstance(raw, dict) else None
         if isinstance(kind, str) and kind.strip().lower() in _BROADCAST_IGNORE_KINDS:
             continue
-        ts = _parse_event_ts(raw_ts, fallback_tz=tz)
-        if ts is None:
+        ms = _event_epoch_ms(raw, fallback_tz=tz)
+        if ms is None:
             continue
-        if last is None or ts > last:
-            last = ts
+        if last is None or ms > last:
+            last = ms
     return last
 
 
+@_locked
 def filter_user_ids_by_broadcast_cooldown(user_ids: list[int], *, days: int = DEFAULT_BROADCAST_COOLDOWN_DAYS) -> list[int]:
     """
     Filters out users who received a non-contest broadcast within the last `days`.
@@ -174,55 +561,69 @@ def filter_user_ids_by_broadcast_cooldown(user_ids: list[int], *, days: int = DE
     data = _load()
     users: dict[str, Any] = data.get("users", {})
     now = _now()
-    cutoff = now - timedelta(days=int(days))
+    cutoff = _epoch_ms(now - timedelta(days=int(days)))
     out: list[int] = []
     for uid in user_ids:
-        rec = users.get(str(int(uid)))
-        if not isinstance(rec, dict):
+        key = str(int(uid))
+        rec = users.get(key)
+        if rec is None:
             out.append(int(uid))
             continue
-        last = _last_broadcast_ts(rec)
+        last = _last_broadcast_ms(key, rec)
         if last is None or last < cutoff:
             out.append(int(uid))
     return out
 
 
-def record_broadcast_sent(user_id: int, *, kind: str, source: str | None = None) -> None:
-    """
-    Record that a broadcast was sent to a user. `kind` is used for cooldown rules.
-    """
-    data = _load()
+def _append_broadcast(
+    data: dict[str, Any], user_id: int, *, kind: str, source: str | None, now_dt: datetime
+) -> None:
     users = data.setdefault("users", {})
     uid = str(int(user_id))
     rec = users.get(uid)
-    now = _now().isoformat()
+    now = now_dt.isoformat()
     src = (source or "").strip().lower() or None
 
-    ev = {"ts": now, "kind": (kind or "").strip().lower()}
+    ev = {"ts": now, "ts_epoch": _epoch_ms(now_dt), "kind": (kind or "").strip().lower()}
     if src:
         ev["src"] = src
 
     if rec is None:
-        users[uid] = {
-            "first_name": None,
-            "username": None,
-            "joined_at": now,
-            "last_seen": now,
-            "unsubscribed_at": None,
-            "clicks": 0,
-            "visits": 0,
-            "visit_events": [],
-            "last_click_at": None,
-            "broadcast_events": [ev],
-        }
+        users[uid] = _new_user_record(now, broadcast_events=[ev])
+        _users_changed()
     else:
-        events = rec.setdefault("broadcast_events", [])
-        if isinstance(events, list):
-            events.append(ev)
-        else:
-            rec["broadcast_events"] = [ev]
-    _save(data)
+        rec["broadcast_events"].append(ev)
+    if ev["kind"] not in _BROADCAST_IGNORE_KINDS and uid in _LAST_BROADCAST_MS:
+        _LAST_BROADCAST_MS[uid] = max(_LAST_BROADCAST_MS[uid] or 0, _epoch_ms(now_dt))
+
+
+@_locked
+def record_broadcast_sent(user_id: int, *, kind: str, source: str | None = None) -> None:
+    """
+    Record that a broadcast was sent to a user. `kind` is used for cooldown rules.
+    """
+    now_dt = _now()
+    _apply(lambda data: _append_broadcast(data, user_id, kind=kind, source=source, now_dt=now_dt))
+
+
+@_locked
+def record_broadcasts_sent(user_ids: list[int], *, kind: str, source: str | None = None) -> None:
+    """
+    record_broadcast_sent() for a batch of recipients on a single load/save.
+    """
+    if not user_ids:
+        return
+    now_dt = _now()
+    batch = list(user_ids)
+
+    def op(data: dict[str, Any]) -> None:
+        for uid in batch:
+            _append_broadcast(data, uid, kind=kind, source=source, now_dt=now_dt)
+
+    _apply(op)
 
+
+@_locked
 def top_users_by_visits_in_month(
     year: int,
     month: int,
@@ -244,13 +645,15 @@ def top_users_by_visits_in_month(
     if limit <= 0:
         limit = 3
 
-    tz = _tyumen_tz()
+    tz = _TYUMEN_TZ
     start = datetime(year, month, 1, tzinfo=tz)
     if month == 12:
         end = datetime(year + 1, 1, 1, tzinfo=tz)
     else:
         end = datetime(year, month + 1, 1, tzinfo=tz)
 
+    start_ms = _epoch_ms(start)
+    end_ms = _epoch_ms(end)
     src = (source or "").strip().lower() or None
 
     data = _load()
@@ -258,13 +661,11 @@ def top_users_by_visits_in_month(
     counts: dict[int, int] = {}
 
     for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
         if active_only and rec.get("unsubscribed_at"):
             continue
 
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list) or not events:
+        events = rec["visit_events"]
+        if not events:
             continue
 
         try:
@@ -272,113 +673,109 @@ def top_users_by_visits_in_month(
         except Exception:
             continue
 
+        n = 0
         for raw in events:
             if not raw:
                 continue
-            if src is not None and _event_src(raw) != src:
+            ms = _event_epoch_ms(raw, fallback_tz=tz)
+            if ms is None or ms < start_ms or ms >= end_ms:
                 continue
-            raw_ts = raw.get("ts") if isinstance(raw, dict) else raw
-            ts = _parse_event_ts(raw_ts, fallback_tz=tz)
-            if ts is None:
+            if src is not None and _event_src(raw) != src:
                 continue
-            local = ts.astimezone(tz)
-            if start <= local < end:
-                counts[user_id] = counts.get(user_id, 0) + 1
+            n += 1
+        if n:
+            counts[user_id] = n
 
-    rows = [{"user_id": uid, "visits": v} for uid, v in counts.items() if v > 0]
-    rows.sort(key=lambda r: (int(r["visits"]), int(r["user_id"])), reverse=True)
-    return rows[:limit]
+    top = heapq.nlargest(limit, counts.items(), key=_COUNT_THEN_ID)
+    return [{"user_id": uid, "visits": v} for uid, v in top]
 
 
+@_locked
 def inc_click(user_id: int) -> None:
-    data = _load()
-    users = data.setdefault("users", {})
     uid = str(user_id)
-    rec = users.get(uid)
-    if rec is None:
-        # user record should be created by touch_user, but keep it safe.
-        now = _now().isoformat()
-        users[uid] = {
-            "first_name": None,
-            "username": None,
-            "joined_at": now,
-            "last_seen": now,
-            "unsubscribed_at": None,
-            "clicks": 1,
-            "visits": 0,
-            "visit_events": [],
-            "last_click_at": now,
-        }
-    else:
-        rec["clicks"] = int(rec.get("clicks", 0)) + 1
-        now = _now().isoformat()
-        rec["last_seen"] = now
-        rec["last_click_at"] = now
-        rec.setdefault("visit_events", [])
-        rec.setdefault("last_click_at", None)
+    now = _now().isoformat()
 
-    _save(data)
+    def op(data: dict[str, Any]) -> None:
+        users = data.setdefault("users", {})
+        rec = users.get(uid)
+        if rec is None:
+            # user record should be created by touch_user, but keep it safe.
+            users[uid] = _new_user_record(now, clicks=1, last_click_at=now)
+            _users_changed()
+        else:
+            rec["clicks"] = int(rec.get("clicks", 0)) + 1
+            rec["last_seen"] = now
+            rec["last_click_at"] = now
+
+    _apply(op)
 
 
+@_locked
 def mark_unsubscribed(user_id: int) -> None:
-    data = _load()
-    users = data.setdefault("users", {})
     uid = str(user_id)
-    rec = users.get(uid)
-    if rec is None:
-        return
-    rec["unsubscribed_at"] = _now().isoformat()
-    _save(data)
+    now = _now().isoformat()
+
+    def op(data: dict[str, Any]) -> bool:
+        rec = data.setdefault("users", {}).get(uid)
+        if rec is None:
+            return False
+        rec["unsubscribed_at"] = now
+        _users_changed()
+        return True
+
+    _apply(op)
 
 
+@_locked
 def active_subscribers_count() -> int:
-    data = _load()
-    users = data.get("users", {})
-    return sum(1 for rec in users.values() if not rec.get("unsubscribed_at"))
+    return len(_active_uids(_load()))
 
 
-def _count_by_window(ts_key: str, days: int) -> int:
-    data = _load()
-    users = data.get("users", {})
-    now = _now()
-    if days == 0:
-        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    else:
-        start = now - timedelta(days=days)
+def _window_starts(now: datetime) -> tuple[datetime, datetime, datetime]:
+    # today (since local midnight), 7d, 30d
+    return (
+        now.replace(hour=0, minute=0, second=0, microsecond=0),
+        now - timedelta(days=7),
+        now - timedelta(days=30),
+    )
 
-    count = 0
-    for rec in users.values():
+
+def _field_epochs(data: dict[str, Any], ts_key: str) -> list[int]:
+    cached = _FIELD_EPOCHS.get(ts_key)
+    if cached is not None:
+        return cached
+    tz = _now().tzinfo
+    out: list[int] = []
+    for rec in data.get("users", {}).values():
         raw = rec.get(ts_key)
         if not raw:
             continue
-        try:
-            ts = datetime.fromisoformat(raw)
-        except Exception:
-            continue
-        if ts.tzinfo is None:
-            ts = ts.replace(tzinfo=now.tzinfo)
-        if ts >= start:
-            count += 1
-    return count
+        ms = _event_epoch_ms(raw, fallback_tz=tz)
+        if ms is not None:
+            out.append(ms)
+    out.sort()
+    _FIELD_EPOCHS[ts_key] = out
+    return out
 
 
+def _count_by_windows(ts_key: str) -> tuple[int, int, int]:
+    epochs = _field_epochs(_load(), ts_key)
+    start_today, start_7, start_30 = (_epoch_ms(t) for t in _window_starts(_now()))
+    return (_count_since(epochs, start_today), _count_since(epochs, start_7), _count_since(epochs, start_30))
+
+
+@_locked
 def subscribed_counts() -> tuple[int, int, int]:
     # today, 7d, 30d
-    return (
-        _count_by_window("joined_at", 0),
-        _count_by_window("joined_at", 7),
-        _count_by_window("joined_at", 30),
-    )
+    return _count_by_windows("joined_at")
 
 
+@_locked
 def unsubscribed_counts() -> tuple[int, int, int]:
-    return (
-        _count_by_window("unsubscribed_at", 0),
-        _count_by_window("unsubscribed_at", 7),
-        _count_by_window("unsubscribed_at", 30),
-    )
+    return _count_by_windows("unsubscribed_at")
 
 
+@_locked
 def visit_counts(*, source: str | None = None) -> tuple[int, int, int]:
     """
     Confirmed visits (marked by an admin) within windows: today / 7d / 30d.
@@ -387,74 +784,89 @@ def visit_counts(*, source: str | None = None) -> tuple[int, int, int]:
     data = _load()
     users = data.get("users", {})
     now = _now()
+    start_today, start_7, start_30 = (_epoch_ms(t) for t in _window_starts(now))
 
     src = (source or "").strip().lower() or None
 
-    def _count_events(days: int) -> int:
-        if days == 0:
-            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        else:
-            start = now - timedelta(days=days)
-        total = 0
-        for rec in users.values():
-            events = rec.get("visit_events") or []
-            if not isinstance(events, list):
+    c0 = c7 = c30 = 0
+    for rec in users.values():
+        # Events are chronological: walk back from the newest and stop at the 30-day mark.
+        for raw in reversed(rec["visit_events"]):
+            if not raw:
                 continue
-            for raw in events:
-                if not raw:
-                    continue
-                if src is not None and _event_src(raw) != src:
-                    continue
-                # Backward compatible: raw can be ISO str or {"ts": "...", "by": admin_id}
-                if isinstance(raw, dict):
-                    raw_ts = raw.get("ts")
-                else:
-                    raw_ts = raw
-                if not raw_ts:
-                    continue
-                try:
-                    ts = datetime.fromisoformat(str(raw_ts))
-                except Exception:
-                    continue
-                if ts.tzinfo is None:
-                    ts = ts.replace(tzinfo=now.tzinfo)
-                if ts >= start:
-                    total += 1
-        return total
+            # Backward compatible: raw can be ISO str or {"ts": "...", "ts_epoch": ms, "by": admin_id}
+            ms = _event_epoch_ms(raw, fallback_tz=now.tzinfo)
+            if ms is None or ms < start_30:
+                break
+            if src is not None and _event_src(raw) != src:
+                continue
+            c30 += 1
+            if ms >= start_7:
+                c7 += 1
+            if ms >= start_today:
+                c0 += 1
+    return (c0, c7, c30)
+
+
+@_locked
+def dashboard_counts(*, source: str | None = None) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    """
+    visit_counts(source=...) and subscribed_counts() from one pass over the users.
+    Returns (visits, subscribed), each as (today, 7d, 30d).
+    """
+    data = _load()
+    users = data.get("users", {})
+    now = _now()
+    start_today, start_7, start_30 = (_epoch_ms(t) for t in _window_starts(now))
+    tz = now.tzinfo
+    src = (source or "").strip().lower() or None
+
+    joined = _field_epochs(data, "joined_at")
+    subscribed = (_count_since(joined, start_today), _count_since(joined, start_7), _count_since(joined, start_30))
 
-    return (_count_events(0), _count_events(7), _count_events(30))
+    v0 = v7 = v30 = 0
+    for rec in users.values():
+        for raw in reversed(rec["visit_events"]):
+            if not raw:
+                continue
+            ms = _event_epoch_ms(raw, fallback_tz=tz)
+            if ms is None or ms < start_30:
+                break
+            if src is not None and _event_src(raw) != src:
+                continue
+            v30 += 1
+            if ms >= start_7:
+                v7 += 1
+            if ms >= start_today:
+                v0 += 1
+    return ((v0, v7, v30), subscribed)
 
 
+@_locked
 def add_visit(user_id: int) -> None:
     """
     Confirm a visit for a user (called by admin actions).
     """
-    data = _load()
-    users = data.setdefault("users", {})
     uid = str(user_id)
-    rec = users.get(uid)
-    if rec is None:
-        now = _now().isoformat()
-        users[uid] = {
-            "first_name": None,
-            "username": None,
-            "joined_at": now,
-            "last_seen": now,
-            "unsubscribed_at": None,
-            "clicks": 0,
-            "visits": 1,
-            "visit_events": [now],
-            "last_click_at": None,
-        }
-    else:
-        rec["visits"] = int(rec.get("visits", 0) or 0) + 1
-        events = rec.setdefault("visit_events", [])
-        if isinstance(events, list):
-            events.append(_now().isoformat())
-        rec.setdefault("last_click_at", None)
-    _save(data)
+    now_dt = _now()
+    now = now_dt.isoformat()
+
+    def op(data: dict[str, Any]) -> None:
+        users = data.setdefault("users", {})
+        rec = users.get(uid)
+        if rec is None:
+            users[uid] = _new_user_record(now, visits=1, visit_events=[now])
+            _users_changed()
+        else:
+            rec["visits"] = int(rec.get("visits", 0) or 0) + 1
+            rec["visit_events"].append(now)
+            _ensure_chronological_tail(rec["visit_events"], tz=now_dt.tzinfo)
+        _note_visit(uid, VISIT_LEGACY_SRC, _epoch_ms(now_dt), total=_total_visits(users[uid]))
+
+    _apply(op)
 
 
+@_locked
 def recent_visit_events(*, offset: int = 0, limit: int = 10, source: str | None = None) -> tuple[list[dict[str, Any]], int]:
     """
     Most recent confirmed visit events across all users (desc by timestamp).
@@ -463,14 +875,11 @@ def recent_visit_events(*, offset: int = 0, limit: int = 10, source: str | None
     data = _load()
     users: dict[str, Any] = data.get("users", {})
     src = (source or "").strip().lower() or None
-    rows: list[dict[str, Any]] = []
+    # (ts, user_id, event): only the requested page is turned into row dicts.
+    found: list[tuple[str, int, dict[str, Any]]] = []
     for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
-            continue
-        for raw in events:
+        user_id = int(uid)
+        for raw in rec["visit_events"]:
             if not raw or not isinstance(raw, dict):
                 continue
             if src is not None and _event_src(raw) != src:
@@ -478,170 +887,247 @@ def recent_visit_events(*, offset: int = 0, limit: int = 10, source: str | None
             ts_raw = raw.get("ts")
             if not ts_raw:
                 continue
-            rows.append(
-                {
-                    "user_id": int(uid),
-                    "ts": str(ts_raw),
-                    "by": raw.get("by"),
-                    "src": _event_src(raw),
-                }
-            )
-
-    def _key(r: dict[str, Any]) -> tuple[str, int]:
-        return (str(r.get("ts") or ""), int(r.get("user_id") or 0))
-
-    rows.sort(key=_key, reverse=True)
-    total = len(rows)
+            found.append((str(ts_raw), user_id, raw))
+
+    total = len(found)
     o = max(int(offset or 0), 0)
     l = max(int(limit or 0), 0)
-    return (rows[o : o + l], total)
+    top = heapq.nlargest(o + l, found, key=itemgetter(0, 1))
+    rows = [
+        {"user_id": user_id, "ts": ts, "by": raw.get("by"), "src": _event_src(raw)}
+        for ts, user_id, raw in top[o : o + l]
+    ]
+    return (rows, total)
 
 
+@_locked
 def top_actions_paged(*, offset: int = 0, limit: int = 10) -> tuple[list[dict[str, Any]], int]:
     data = _load()
     actions = data.get("actions", {}) or {}
     if not isinstance(actions, dict):
         return ([], 0)
     rows = [{"action": k, "count": int(v or 0)} for k, v in actions.items()]
-    rows = [r for r in rows if int(r.get("count", 0) or 0) > 0]
-    rows.sort(key=lambda r: (int(r["count"]), str(r["action"])), reverse=True)
+    rows = [r for r in rows if r["count"] > 0]
     total = len(rows)
     o = max(int(offset or 0), 0)
     l = max(int(limit or 0), 0)
-    return (rows[o : o + l], total)
+    # "count" is an int and "action" a key string already.
+    top = heapq.nlargest(o + l, rows, key=itemgetter("count", "action"))
+    return (top[o : o + l], total)
 
-def add_visit_marked(user_id: int, admin_id: int, *, source: str | None = None) -> None:
-    """
-    Confirm a visit and attribute it to the admin who marked it.
-    """
-    data = _load()
+def _append_marked_visit(data: dict[str, Any], user_id: int, admin_id: int, src: str, *, now_dt: datetime) -> None:
     users = data.setdefault("users", {})
     uid = str(user_id)
     rec = users.get(uid)
-    now = _now().isoformat()
-    src = (source or "").strip().lower() or VISIT_LEGACY_SRC
+    now = now_dt.isoformat()
+    ev = {"ts": now, "ts_epoch": _epoch_ms(now_dt), "by": int(admin_id), "src": src}
 
     if rec is None:
-        users[uid] = {
-            "first_name": None,
-            "username": None,
-            "joined_at": now,
-            "last_seen": now,
-            "unsubscribed_at": None,
-            "clicks": 0,
-            "visits": 1,
-            "visit_events": [{"ts": now, "by": int(admin_id), "src": src}],
-            "last_click_at": None,
-        }
+        users[uid] = _new_user_record(now, visits=1, visit_events=[ev])
+        _users_changed()
     else:
         rec["visits"] = int(rec.get("visits", 0) or 0) + 1
-        events = rec.setdefault("visit_events", [])
-        if isinstance(events, list):
-            events.append({"ts": now, "by": int(admin_id), "src": src})
-        rec.setdefault("last_click_at", None)
-
-    _save(data)
+        rec["visit_events"].append(ev)
+        _ensure_chronological_tail(rec["visit_events"], tz=now_dt.tzinfo)
+    _note_visit(uid, src, ev["ts_epoch"], admin_id=ev["by"], ts_raw=now, total=_total_visits(users[uid]))
 
 
-def can_add_visit_today_tyumen(user_id: int, *, source: str | None = None) -> bool:
+@_locked
+def add_visit_marked(user_id: int, admin_id: int, *, source: str | None = None) -> None:
     """
-    Rule: per client, max 1 confirmed visit per business day.
-    Business day resets at 06:00 Tyumen time.
+    Confirm a visit and attribute it to the admin who marked it.
     """
-    data = _load()
-    users = data.get("users", {})
-    rec = users.get(str(user_id))
-    if not isinstance(rec, dict):
-        return True
+    src = (source or "").strip().lower() or VISIT_LEGACY_SRC
+    now_dt = _now()
+    _apply(lambda data: _append_marked_visit(data, user_id, admin_id, src, now_dt=now_dt))
 
-    events = rec.get("visit_events") or []
-    if not isinstance(events, list) or not events:
-        return True
 
-    now = _now()
-    tz = _tyumen_tz()
-    start = _tyumen_window_start(now)
-    end = start + timedelta(days=1)
-    src = (source or "").strip().lower() or None
+def _ensure_chronological_tail(events: list[Any], *, tz) -> None:
+    # Only the new last event can be out of place (clock stepped back); re-sort just in that case.
+    if len(events) < 2:
+        return
+    prev = _event_epoch_ms(events[-2], fallback_tz=tz) if events[-2] else None
+    last = _event_epoch_ms(events[-1], fallback_tz=tz)
+    if prev is not None and last is not None and last < prev:
+        _ensure_chronological(events, tz=tz)
 
-    for raw in events:
-        if not raw:
-            continue
-        if src is not None and _event_src(raw) != src:
-            continue
-        if isinstance(raw, dict):
-            raw_ts = raw.get("ts")
-        else:
-            raw_ts = raw
-        ts = _parse_event_ts(raw_ts, fallback_tz=tz)
-        if ts is None:
-            continue
-        local = ts.astimezone(tz)
-        if start <= local < end:
-            return False
-    return True
 
+def _user_visit_epochs(data: dict[str, Any], uid: str, *, src: str | None) -> list[int]:
+    key = (uid, src)
+    cached = _VISIT_EPOCHS.get(key)
+    if cached is not None:
+        return cached
 
-def active_user_ids() -> list[int]:
-    """
-    Users who are not marked as unsubscribed.
-    """
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
     out: list[int] = []
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        if rec.get("unsubscribed_at"):
-            continue
-        try:
-            out.append(int(uid))
-        except Exception:
-            continue
+    rec = data.get("users", {}).get(uid)
+    if rec is not None:
+        events = rec["visit_events"]
+        tz = _now().tzinfo
+        for raw in events:
+            if not raw:
+                continue
+            if src is not None and _event_src(raw) != src:
+                continue
+            ms = _event_epoch_ms(raw, fallback_tz=tz)
+            if ms is None:
+                continue
+            out.append(ms)
+    # Appends are chronological already; sorting just guards against events merged from the other bot.
+    out.sort()
+    _VISIT_EPOCHS[key] = out
     return out
 
 
-def _last_visit_ts(rec: dict[str, Any], *, source: str | None = None) -> datetime | None:
-    events = rec.get("visit_events") or []
-    if not isinstance(events, list) or not events:
-        return None
-    tz = _tyumen_tz()
-    src = (source or "").strip().lower() or None
-    last: datetime | None = None
-    for raw in events:
-        if not raw:
+def _count_since(epochs: list[int], start_ms: int) -> int:
+    return len(epochs) - bisect_left(epochs, start_ms)
+
+
+def _last_visits(data: dict[str, Any], uid: str) -> dict[str, int]:
+    cached = _LAST_VISIT_MS.get(uid)
+    if cached is not None:
+        return cached
+
+    out: dict[str, int] = {}
+    rec = data.get("users", {}).get(uid)
+    if rec is not None:
+        tz = _now().tzinfo
+        for raw in rec["visit_events"]:
+            if not raw:
+                continue
+            ms = _event_epoch_ms(raw, fallback_tz=tz)
+            if ms is None:
+                continue
+            src = _event_src(raw)
+            if ms > out.get(src, ms - 1):
+                out[src] = ms
+    _LAST_VISIT_MS[uid] = out
+    return out
+
+
+def _note_visit(
+    uid: str,
+    src: str,
+    ms: int,
+    *,
+    admin_id: int | None = None,
+    ts_raw: str | None = None,
+    total: int | None = None,
+) -> None:
+    """
+    Fold one appended visit into whichever derived indexes are already built, so marking a visit
+    doesn't throw them away; anything not built yet is scanned on first use as usual.
+    `total` is the user's visit total after the append (it went up by exactly one).
+    """
+    for active_only in (True, False):
+        cached = _ORDERS.get(("visits", active_only))
+        if cached is None:
             continue
-        if src is not None and _event_src(raw) != src:
+        uids, keys = cached
+        old_key = (1 - total, -int(uid)) if total is not None else None
+        i = bisect_left(keys, old_key) if old_key is not None and keys is not None else len(uids)
+        if i >= len(uids) or uids[i] != uid:
+            # Not listed (new or unsubscribed user) or no total given: rebuild on next use.
+            del _ORDERS[("visits", active_only)]
             continue
-        if isinstance(raw, dict):
-            raw_ts = raw.get("ts")
-        else:
-            raw_ts = raw
-        ts = _parse_event_ts(raw_ts, fallback_tz=tz)
-        if ts is None:
+        del uids[i], keys[i]
+        new_key = (-total, -int(uid))
+        j = bisect_left(keys, new_key)
+        uids.insert(j, uid)
+        keys.insert(j, new_key)
+    last = _LAST_VISIT_MS.get(uid)
+    if last is not None and ms > last.get(src, ms - 1):
+        last[src] = ms
+    for key in ((uid, src), (uid, None)):
+        epochs = _VISIT_EPOCHS.get(key)
+        if epochs is not None:
+            insort(epochs, ms)
+    if admin_id is None:
+        return
+    if _ADMIN_TOTALS is not None:
+        _ADMIN_TOTALS[(admin_id, src)] += 1
+        _ADMIN_TOTALS[(admin_id, None)] += 1
+    if _MARKED_INDEX is not None:
+        _MARKED_INDEX.append((admin_id, int(uid), src, ts_raw or "", ms))
+    if _ADMIN_EPOCHS is not None:
+        for key in ((admin_id, src), (admin_id, None)):
+            epochs, total = _ADMIN_EPOCHS.get(key, ([], 0))
+            insort(epochs, ms)
+            _ADMIN_EPOCHS[key] = (epochs, total + 1)
+
+
+def _has_visit_today_tyumen(data: dict[str, Any], uid: str, *, src: str | None, now: datetime) -> bool:
+    last = _last_visit_ms(data, uid, src=src)
+    start_ms, end_ms = _tyumen_window_ms(now)
+    if last is None or last < start_ms:
+        return False
+    if last < end_ms:
+        return True
+    # Latest event is dated past today's window (clock skew); look for one inside it.
+    epochs = _user_visit_epochs(data, uid, src=src)
+    i = bisect_left(epochs, start_ms)
+    return i < len(epochs) and epochs[i] < end_ms
+
+
+@_locked
+def can_add_visit_today_tyumen(user_id: int, *, source: str | None = None) -> bool:
+    """
+    Rule: per client, max 1 confirmed visit per business day.
+    Business day resets at 06:00 Tyumen time.
+    """
+    src = (source or "").strip().lower() or None
+    return not _has_visit_today_tyumen(_load(), str(user_id), src=src, now=_now())
+
+
+@_locked
+def add_visit_marked_if_allowed(user_id: int, admin_id: int, *, source: str | None = None) -> bool:
+    """
+    can_add_visit_today_tyumen() + add_visit_marked() under one lock hold.
+    Returns False (and records nothing) if the client already has a visit this business day.
+    """
+    now_dt = _now()
+    check_src = (source or "").strip().lower() or None
+    if _has_visit_today_tyumen(_load(), str(user_id), src=check_src, now=now_dt):
+        return False
+    # Replayed as a plain append: the admin has already been told the visit counted.
+    src = check_src or VISIT_LEGACY_SRC
+    _apply(lambda data: _append_marked_visit(data, user_id, admin_id, src, now_dt=now_dt))
+    return True
+
+
+@_locked
+def active_user_ids() -> list[int]:
+    """
+    Users who are not marked as unsubscribed.
+    """
+    out: list[int] = []
+    for uid in _active_uids(_load()):
+        try:
+            out.append(int(uid))
+        except Exception:
             continue
-        if last is None or ts > last:
-            last = ts
-    return last
+    return out
 
 
+def _last_visit_ms(data: dict[str, Any], uid: str, *, src: str | None) -> int | None:
+    last_by_src = _last_visits(data, uid)
+    if src is not None:
+        return last_by_src.get(src)
+    return max(last_by_src.values(), default=None)
+
+
+@_locked
 def users_no_visits_for_days(days: int, *, source: str | None = None) -> list[int]:
     """
     Active users with no confirmed visits in the last `days` (or never had a visit).
     """
     data = _load()
-    users: dict[str, Any] = data.get("users", {})
     now = _now()
-    cutoff = now - timedelta(days=int(days))
+    cutoff = _epoch_ms(now - timedelta(days=int(days)))
     out: list[int] = []
     src = (source or "").strip().lower() or None
 
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        if rec.get("unsubscribed_at"):
-            continue
-        last = _last_visit_ts(rec, source=src)
+    for uid in _active_uids(data):
+        last = _last_visit_ms(data, uid, src=src)
         if last is None or last < cutoff:
             try:
                 out.append(int(uid))
@@ -650,24 +1136,20 @@ def users_no_visits_for_days(days: int, *, source: str | None = None) -> list[in
     return out
 
 
+@_locked
 def users_last_visit_older_than_days(days: int, *, source: str | None = None) -> list[int]:
     """
     Active users whose last confirmed visit is older than `days`.
     Users with no visits ever are NOT included.
     """
     data = _load()
-    users: dict[str, Any] = data.get("users", {})
     now = _now()
-    cutoff = now - timedelta(days=int(days))
+    cutoff = _epoch_ms(now - timedelta(days=int(days)))
     out: list[int] = []
     src = (source or "").strip().lower() or None
 
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        if rec.get("unsubscribed_at"):
-            continue
-        last = _last_visit_ts(rec, source=src)
+    for uid in _active_uids(data):
+        last = _last_visit_ms(data, uid, src=src)
         if last is None:
             continue
         if last < cutoff:
@@ -678,6 +1160,7 @@ def users_last_visit_older_than_days(days: int, *, source: str | None = None) ->
     return out
 
 
+@_locked
 def users_no_visits_between_days(min_days: int, max_days: int, *, source: str | None = None) -> list[int]:
     """
     Active users whose last confirmed visit is within a "no visits" band:
@@ -695,19 +1178,14 @@ def users_no_visits_between_days(min_days: int, max_days: int, *, source: str |
         max_days = min_days + 1
 
     data = _load()
-    users: dict[str, Any] = data.get("users", {})
     now = _now()
-    newer_than = now - timedelta(days=max_days)
-    older_than = now - timedelta(days=min_days)
+    newer_than = _epoch_ms(now - timedelta(days=max_days))
+    older_than = _epoch_ms(now - timedelta(days=min_days))
     out: list[int] = []
     src = (source or "").strip().lower() or None
 
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        if rec.get("unsubscribed_at"):
-            continue
-        last = _last_visit_ts(rec, source=src)
+    for uid in _active_uids(data):
+        last = _last_visit_ms(data, uid, src=src)
         if last is None:
             continue
         # older than `min_days`, but not older than `max_days`
@@ -720,6 +1198,7 @@ def users_no_visits_between_days(min_days: int, max_days: int, *, source: str |
     return out
 
 
+@_locked
 def user_visit_counts(user_id: int) -> tuple[int, int, int]:
     """
     Per-user confirmed visits:
@@ -733,128 +1212,146 @@ def user_visit_counts(user_id: int) -> tuple[int, int, int]:
     now = _now()
 
     events = rec.get("visit_events") or []
-    if not isinstance(events, list):
-        events = []
+    epochs = _user_visit_epochs(data, str(user_id), src=None)
 
-    def _count_since(days: int) -> int:
-        start = now - timedelta(days=days)
-        cnt = 0
-        for raw in events:
-            if not raw:
-                continue
-            if isinstance(raw, dict):
-                raw_ts = raw.get("ts")
-            else:
-                raw_ts = raw
-            if not raw_ts:
-                continue
-            try:
-                ts = datetime.fromisoformat(str(raw_ts))
-            except Exception:
-                continue
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=now.tzinfo)
-            if ts >= start:
-                cnt += 1
-        return cnt
+    start_7 = _epoch_ms(now - timedelta(days=7))
+    start_30 = _epoch_ms(now - timedelta(days=30))
 
     total = int(rec.get("visits", 0) or 0)
     # Prefer events length if it's higher (safer on old data).
     total = max(total, len(events))
-    return (_count_since(7), _count_since(30), total)
+    return (_count_since(epochs, start_7), _count_since(epochs, start_30), total)
 
+def _marked_visits(data: dict[str, Any]) -> list[_MarkedVisit]:
+    """
+    One pass over users -> visit_events for everything the per-admin queries need.
+    Legacy events (plain ISO strings) have no admin attribution and are skipped.
+    """
+    global _MARKED_INDEX
+    if _MARKED_INDEX is not None:
+        return _MARKED_INDEX
+    tz = _now().tzinfo
+    out: list[_MarkedVisit] = []
+    for uid, rec in (data.get("users") or {}).items():
+        events = rec["visit_events"]
+        try:
+            user_id = int(uid)
+        except Exception:
+            user_id = None
+        for raw in events:
+            if not isinstance(raw, dict):
+                continue
+            aid = raw.get("by")
+            ts_raw = raw.get("ts")
+            if aid is None or not ts_raw:
+                continue
+            out.append((aid, user_id, _event_src(raw), str(ts_raw), _event_epoch_ms(raw, fallback_tz=tz)))
+    _MARKED_INDEX = out
+    return out
+
+
+def _admin_epochs(data: dict[str, Any]) -> dict[tuple[int, str | None], tuple[list[int], int]]:
+    """
+    Per-admin sorted timestamps, keyed by (admin_id, src) plus (admin_id, None) for all sources.
+    """
+    global _ADMIN_EPOCHS
+    if _ADMIN_EPOCHS is not None:
+        return _ADMIN_EPOCHS
+    grouped: dict[tuple[int, str | None], list[int]] = {}
+    totals: Counter[tuple[int, str | None]] = Counter()
+    for aid, _uid, ev_src, _ts_raw, ms in _marked_visits(data):
+        for key in ((aid, ev_src), (aid, None)):
+            totals[key] += 1
+            if ms is not None:
+                grouped.setdefault(key, []).append(ms)
+    out: dict[tuple[int, str | None], tuple[list[int], int]] = {}
+    for key, total in totals.items():
+        epochs = grouped.get(key, [])
+        epochs.sort()
+        out[key] = (epochs, total)
+    _ADMIN_EPOCHS = out
+    return out
+
+
+def _admin_totals(data: dict[str, Any]) -> Counter[tuple[int, str | None]]:
+    global _ADMIN_TOTALS
+    if _ADMIN_TOTALS is not None:
+        return _ADMIN_TOTALS
+    totals: Counter[tuple[int, str | None]] = Counter()
+    for rec in (data.get("users") or {}).values():
+        for raw in rec["visit_events"]:
+            if isinstance(raw, dict) and raw.get("by") is not None:
+                totals[(raw["by"], _event_src(raw))] += 1
+                totals[(raw["by"], None)] += 1
+    _ADMIN_TOTALS = totals
+    return totals
+
+
+@_locked
 def top_admins_by_marked_visits(*, source: str | None = None, days: int = 30, limit: int = 100) -> list[dict[str, Any]]:
     """
     Returns rows: {admin_id, visits} for admins who marked >=1 visit in the last `days`.
     """
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
-    now = _now()
-    start = now - timedelta(days=days)
+    start_ms = _epoch_ms(_now() - timedelta(days=days))
     src = (source or "").strip().lower() or None
 
     counts: dict[int, int] = {}
-    for rec in users.values():
-        if not isinstance(rec, dict):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
+    for (aid, key_src), (epochs, _total) in _admin_epochs(_load()).items():
+        if key_src != src:
             continue
-        for raw in events:
-            if not raw:
-                continue
-            if not isinstance(raw, dict):
-                # old format: no admin attribution
-                continue
-            if src is not None and _event_src(raw) != src:
-                continue
-            by = raw.get("by")
-            ts_raw = raw.get("ts")
-            if by is None or not ts_raw:
-                continue
-            try:
-                ts = datetime.fromisoformat(str(ts_raw))
-            except Exception:
-                continue
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=now.tzinfo)
-            if ts < start:
-                continue
-            try:
-                aid = int(by)
-            except Exception:
-                continue
-            counts[aid] = counts.get(aid, 0) + 1
+        n = _count_since(epochs, start_ms)
+        if n > 0:
+            counts[aid] = n
 
-    rows = [{"admin_id": aid, "visits": v} for aid, v in counts.items() if v > 0]
-    rows.sort(key=lambda r: (int(r["visits"]), int(r["admin_id"])), reverse=True)
-    return rows[:limit]
+    top = heapq.nlargest(max(int(limit), 0), counts.items(), key=_COUNT_THEN_ID)
+    return [{"admin_id": aid, "visits": v} for aid, v in top]
 
 
+@_locked
 def admin_marked_visits_counts(admin_id: int, *, source: str | None = None, days: int = 30) -> tuple[int, int]:
     """
     Returns:
     - marked visits within last `days`
     - total marked visits (all time)
     """
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
-    now = _now()
-    start = now - timedelta(days=days)
+    start_ms = _epoch_ms(_now() - timedelta(days=days))
     src = (source or "").strip().lower() or None
 
-    total = 0
-    recent = 0
-    for rec in users.values():
-        if not isinstance(rec, dict):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
+    epochs, total = _admin_epochs(_load()).get((int(admin_id), src), ([], 0))
+    return (_count_since(epochs, start_ms), total)
+
+
+@_locked
+def admin_marked_visits_summaries(
+    admin_ids: list[int] | set[int], *, source: str | None = None
+) -> dict[int, tuple[int, int, int, int]]:
+    """
+    Same as admin_marked_visits_summary(), but for several admins in one pass.
+    Every requested admin is present in the result (zeros if nothing marked).
+    """
+    wanted: set[int] = set()
+    for aid in admin_ids:
+        try:
+            wanted.add(int(aid))
+        except Exception:
             continue
-        for raw in events:
-            if not isinstance(raw, dict):
-                continue
-            if src is not None and _event_src(raw) != src:
-                continue
-            by = raw.get("by")
-            ts_raw = raw.get("ts")
-            if by is None or not ts_raw:
-                continue
-            try:
-                if int(by) != int(admin_id):
-                    continue
-            except Exception:
-                continue
-            total += 1
-            try:
-                ts = datetime.fromisoformat(str(ts_raw))
-            except Exception:
-                continue
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=now.tzinfo)
-            if ts >= start:
-                recent += 1
-    return (recent, total)
+    if not wanted:
+        return {}
+
+    start_today, start_7, start_30 = (_epoch_ms(t) for t in _window_starts(_now()))
+    src = (source or "").strip().lower() or None
+    index = _admin_epochs(_load())
+
+    out: dict[int, tuple[int, int, int, int]] = {}
+    for aid in wanted:
+        epochs, total = index.get((aid, src), ([], 0))
+        out[aid] = (
+            _count_since(epochs, start_today),
+            _count_since(epochs, start_7),
+            _count_since(epochs, start_30),
+            total,
+        )
+    return out
 
 
 def admin_marked_visits_summary(admin_id: int, *, source: str | None = None) -> tuple[int, int, int, int]:
@@ -865,100 +1362,36 @@ def admin_marked_visits_summary(admin_id: int, *, source: str | None = None) ->
     - last 30 days
     - total (all time)
     """
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
-    now = _now()
-    start_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    start_7 = now - timedelta(days=7)
-    start_30 = now - timedelta(days=30)
-    src = (source or "").strip().lower() or None
+    return admin_marked_visits_summaries([admin_id], source=source).get(int(admin_id), (0, 0, 0, 0))
 
-    total = 0
-    c_today = 0
-    c_7 = 0
-    c_30 = 0
 
-    for rec in users.values():
-        if not isinstance(rec, dict):
+def _admin_marked_rows(admin_id: int, *, source: str | None, n: int) -> tuple[list[dict[str, Any]], int]:
+    """Newest `n` marked visits by this admin (ts desc) plus the total count."""
+    src = (source or "").strip().lower() or None
+    admin_id = int(admin_id)
+    hits: list[tuple[str, int]] = []
+    for aid, user_id, ev_src, ts_raw, _ms in _marked_visits(_load()):
+        if aid != admin_id or user_id is None:
             continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
+        if src is not None and ev_src != src:
             continue
-        for raw in events:
-            if not isinstance(raw, dict):
-                continue
-            if src is not None and _event_src(raw) != src:
-                continue
-            by = raw.get("by")
-            ts_raw = raw.get("ts")
-            if by is None or not ts_raw:
-                continue
-            try:
-                if int(by) != int(admin_id):
-                    continue
-            except Exception:
-                continue
-            total += 1
-            try:
-                ts = datetime.fromisoformat(str(ts_raw))
-            except Exception:
-                continue
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=now.tzinfo)
-            if ts >= start_today:
-                c_today += 1
-            if ts >= start_7:
-                c_7 += 1
-            if ts >= start_30:
-                c_30 += 1
+        hits.append((ts_raw, user_id))
 
-    return (c_today, c_7, c_30, total)
+    # ISO strings sort chronologically as strings in the same format.
+    top = heapq.nlargest(max(n, 0), hits)
+    return ([{"user_id": user_id, "ts": ts_raw} for ts_raw, user_id in top], len(hits))
 
 
+@_locked
 def admin_marked_recent_clients(admin_id: int, *, source: str | None = None, limit: int = 20) -> list[dict[str, Any]]:
     """
     Returns recent marked visits by an admin:
     [{user_id, ts}] sorted by ts desc, limited.
     """
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
-    src = (source or "").strip().lower() or None
-
-    rows: list[dict[str, Any]] = []
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
-            continue
-        for raw in events:
-            if not isinstance(raw, dict):
-                continue
-            if src is not None and _event_src(raw) != src:
-                continue
-            by = raw.get("by")
-            ts_raw = raw.get("ts")
-            if by is None or not ts_raw:
-                continue
-            try:
-                if int(by) != int(admin_id):
-                    continue
-            except Exception:
-                continue
-            try:
-                user_id = int(uid)
-            except Exception:
-                continue
-            rows.append({"user_id": user_id, "ts": str(ts_raw)})
-
-    def _key(r: dict[str, Any]) -> tuple[str, int]:
-        # ISO strings sort chronologically as strings in the same format.
-        return (str(r.get("ts") or ""), int(r.get("user_id") or 0))
-
-    rows.sort(key=_key, reverse=True)
-    return rows[:limit]
+    return _admin_marked_rows(admin_id, source=source, n=limit)[0]
 
 
+@_locked
 def admin_marked_recent_clients_page(
     admin_id: int, *, source: str | None = None, offset: int = 0, limit: int = 20
 ) -> tuple[list[dict[str, Any]], int]:
@@ -970,110 +1403,117 @@ def admin_marked_recent_clients_page(
     if limit <= 0:
         limit = 20
 
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
-    src = (source or "").strip().lower() or None
-
-    rows: list[dict[str, Any]] = []
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
-            continue
-        for raw in events:
-            if not isinstance(raw, dict):
-                continue
-            if src is not None and _event_src(raw) != src:
-                continue
-            by = raw.get("by")
-            ts_raw = raw.get("ts")
-            if by is None or not ts_raw:
-                continue
-            try:
-                if int(by) != int(admin_id):
-                    continue
-            except Exception:
-                continue
-            try:
-                user_id = int(uid)
-            except Exception:
-                continue
-            rows.append({"user_id": user_id, "ts": str(ts_raw)})
-
-    def _key(r: dict[str, Any]) -> tuple[str, int]:
-        return (str(r.get("ts") or ""), int(r.get("user_id") or 0))
-
-    rows.sort(key=_key, reverse=True)
-    total = len(rows)
-    return (rows[offset : offset + limit], total)
+    rows, total = _admin_marked_rows(admin_id, source=source, n=offset + limit)
+    return (rows[offset:], total)
 
 
+@_locked
 def find_user_id_by_username(username: str) -> int | None:
     """
     Lookup user_id by stored telegram username (case-insensitive, without @).
     """
-    u = (username or "").strip().lstrip("@").lower()
+    global _USERNAME_INDEX
+    u = _norm_username(username)
     if not u:
         return None
     data = _load()
-    users: dict[str, Any] = data.get("users", {})
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        ru = (rec.get("username") or "").strip().lstrip("@").lower()
-        if ru and ru == u:
+    if _USERNAME_INDEX is None:
+        index: dict[str, int | None] = {}
+        for uid, rec in data.get("users", {}).items():
+            ru = _norm_username(rec.get("username"))
+            if not ru or ru in index:
+                continue
             try:
-                return int(uid)
+                index[ru] = int(uid)
             except Exception:
-                return None
-    return None
+                index[ru] = None
+        _USERNAME_INDEX = index
+    return _USERNAME_INDEX.get(u)
+
 
+def _click_key(kv: tuple[str, dict[str, Any]]) -> tuple[int, int]:
+    return (int(kv[1].get("clicks", 0) or 0), int(kv[0]))
 
+
+def _click_row(uid: str, rec: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "user_id": int(uid),
+        "first_name": rec.get("first_name"),
+        "username": rec.get("username"),
+        "clicks": int(rec.get("clicks", 0) or 0),
+        "visits": int(rec.get("visits", 0) or 0),
+        "last_click_at": rec.get("last_click_at"),
+        "active": not bool(rec.get("unsubscribed_at")),
+    }
+
+
+@_locked
 def top_by_clicks(limit: int = 50) -> list[dict[str, Any]]:
     data = _load()
     users: dict[str, Any] = data.get("users", {})
 
-    rows = []
-    for uid, rec in users.items():
-        rows.append(
-            {
-                "user_id": int(uid),
-                "first_name": rec.get("first_name"),
-                "username": rec.get("username"),
-                "clicks": int(rec.get("clicks", 0) or 0),
-                "visits": int(rec.get("visits", 0) or 0),
-                "last_click_at": rec.get("last_click_at"),
-                "active": not bool(rec.get("unsubscribed_at")),
-            }
-        )
-
-    rows.sort(key=lambda r: (r["clicks"], r["user_id"]), reverse=True)
-    return rows[:limit]
+    # Pick the winners first, build row dicts only for them.
+    top = heapq.nlargest(max(int(limit), 0), users.items(), key=_click_key)
+    return [_click_row(uid, rec) for uid, rec in top]
 
 
+@_locked
 def top_by_clicks_paged(*, offset: int = 0, limit: int = 10, active_only: bool = True) -> tuple[list[dict[str, Any]], int]:
-    rows = top_by_clicks(limit=1000000)
+    data = _load()
+    users: dict[str, Any] = data.get("users", {})
     if active_only:
-        rows = [r for r in rows if r.get("active")]
-    total = len(rows)
+        candidates = [(uid, users[uid]) for uid in _active_uids(data)]
+    else:
+        candidates = list(users.items())
+    total = len(candidates)
     o = max(int(offset or 0), 0)
     l = max(int(limit or 0), 0)
-    return (rows[o : o + l], total)
+    top = heapq.nlargest(o + l, candidates, key=_click_key)
+    return ([_click_row(uid, rec) for uid, rec in top[o : o + l]], total)
 
 
+def _total_visits(rec: dict[str, Any]) -> int:
+    return max(int(rec.get("visits", 0) or 0), len(rec["visit_events"]))
+
+
+def _user_order(data: dict[str, Any], listing: str, *, active_only: bool) -> list[str]:
+    """
+    User ids sorted for a paged listing: "joined" (newest joined_at first) or "visits" (most visits first),
+    ties by user id desc. Cached until the order can change.
+    """
+    key = (listing, bool(active_only))
+    cached = _ORDERS.get(key)
+    if cached is not None:
+        return cached[0]
+    users: dict[str, Any] = data.get("users", {})
+    uids = list(_active_uids(data)) if active_only else list(users)
+    keys: list[tuple[int, int]] | None = None
+    if listing == "joined":
+        # ISO strings order chronologically; decorate once per user rather than through a key lambda.
+        joined = sorted(((str(users[uid].get("joined_at") or ""), int(uid), uid) for uid in uids), reverse=True)
+        uids = [uid for _ts, _n, uid in joined]
+    else:
+        # Ascending negated keys give the same (visits desc, user id desc) order and stay bisectable.
+        pairs = sorted(((-_total_visits(users[uid]), -int(uid)), uid) for uid in uids)
+        keys = [k for k, _uid in pairs]
+        uids = [uid for _k, uid in pairs]
+    _ORDERS[key] = (uids, keys)
+    return uids
+
+
+@_locked
 def recent_subscribers(*, offset: int = 0, limit: int = 10, active_only: bool = True) -> tuple[list[dict[str, Any]], int]:
     """
     Most recent subscribers by joined_at (desc). Rows include joined_at and user meta.
     """
     data = _load()
     users: dict[str, Any] = data.get("users", {})
+    order = _user_order(data, "joined", active_only=active_only)
+    o = max(int(offset or 0), 0)
+    l = max(int(limit or 0), 0)
     rows: list[dict[str, Any]] = []
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        if active_only and rec.get("unsubscribed_at"):
-            continue
+    for uid in order[o : o + l]:
+        rec = users[uid]
         rows.append(
             {
                 "user_id": int(uid),
@@ -1083,34 +1523,34 @@ def recent_subscribers(*, offset: int = 0, limit: int = 10, active_only: bool =
                 "joined_at": rec.get("joined_at"),
             }
         )
-
-    def _key(r: dict[str, Any]) -> tuple[str, int]:
-        return (str(r.get("joined_at") or ""), int(r.get("user_id") or 0))
-
-    rows.sort(key=_key, reverse=True)
-    total = len(rows)
-    o = max(int(offset or 0), 0)
-    l = max(int(limit or 0), 0)
-    return (rows[o : o + l], total)
+    return (rows, len(order))
 
 
+@_locked
 def top_by_visits_paged(*, offset: int = 0, limit: int = 10, active_only: bool = True) -> tuple[list[dict[str, Any]], int]:
     """
     Top users by total confirmed visits (all time), desc.
     """
     data = _load()
     users: dict[str, Any] = data.get("users", {})
+    o = max(int(offset or 0), 0)
+    l = max(int(limit or 0), 0)
+    if o == 0 and ("visits", bool(active_only)) not in _ORDERS:
+        # First page with nothing cached (the dashboard hit, often right after a reload):
+        # a partial sort is enough; paging further builds the full cached order.
+        uids = list(_active_uids(data)) if active_only else list(users)
+        total = len(uids)
+        page = [
+            uid
+            for _k, uid in heapq.nsmallest(l, (((-_total_visits(users[uid]), -int(uid)), uid) for uid in uids))
+        ]
+    else:
+        order = _user_order(data, "visits", active_only=active_only)
+        total = len(order)
+        page = order[o : o + l]
     rows: list[dict[str, Any]] = []
-    for uid, rec in users.items():
-        if not isinstance(rec, dict):
-            continue
-        if active_only and rec.get("unsubscribed_at"):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
-            events = []
-        v = int(rec.get("visits", 0) or 0)
-        v = max(v, len(events))
+    for uid in page:
+        rec = users[uid]
         rows.append(
             {
                 "user_id": int(uid),
@@ -1118,58 +1558,35 @@ def top_by_visits_paged(*, offset: int = 0, limit: int = 10, active_only: bool =
                 "last_name": rec.get("last_name"),
                 "username": rec.get("username"),
                 "clicks": int(rec.get("clicks", 0) or 0),
-                "visits": v,
+                "visits": _total_visits(rec),
                 "active": not bool(rec.get("unsubscribed_at")),
             }
         )
-    rows.sort(key=lambda r: (int(r.get("visits", 0) or 0), int(r.get("user_id", 0) or 0)), reverse=True)
-    total = len(rows)
-    o = max(int(offset or 0), 0)
-    l = max(int(limit or 0), 0)
-    return (rows[o : o + l], total)
+    return (rows, total)
 
 
+@_locked
 def top_admins_by_marked_visits_all_time(*, source: str | None = None, limit: int = 100) -> list[dict[str, Any]]:
     """
     Returns rows: {admin_id, visits} for admins who marked >=1 visit (all time).
     """
-    data = _load()
-    users: dict[str, Any] = data.get("users", {})
     src = (source or "").strip().lower() or None
+    counts = ((aid, n) for (aid, key_src), n in _admin_totals(_load()).items() if key_src == src)
 
-    counts: dict[int, int] = {}
-    for rec in users.values():
-        if not isinstance(rec, dict):
-            continue
-        events = rec.get("visit_events") or []
-        if not isinstance(events, list):
-            continue
-        for raw in events:
-            if not raw or not isinstance(raw, dict):
-                continue
-            if src is not None and _event_src(raw) != src:
-                continue
-            by = raw.get("by")
-            if by is None:
-                continue
-            try:
-                aid = int(by)
-            except Exception:
-                continue
-            counts[aid] = counts.get(aid, 0) + 1
-
-    rows = [{"admin_id": aid, "visits": v} for aid, v in counts.items() if v > 0]
-    rows.sort(key=lambda r: (int(r["visits"]), int(r["admin_id"])), reverse=True)
-    return rows[: int(limit or 100)]
+    # Not most_common(): ties must keep ordering by admin id.
+    top = heapq.nlargest(int(limit or 100), counts, key=_COUNT_THEN_ID)
+    return [{"admin_id": aid, "visits": v} for aid, v in top]
 
 
+@_locked
 def get_user_stats(user_id: int) -> dict[str, Any] | None:
     data = _load()
     users = data.get("users", {})
     rec = users.get(str(user_id))
-    if not isinstance(rec, dict):
+    if rec is None:
         return None
-    return rec
+    # Shallow copy: the cached record keeps changing under other threads.
+    return dict(rec)
 
 
 def has_click_in_last_days(user_id: int, days: int) -> bool:
@@ -1182,10 +1599,7 @@ def has_click_in_last_days(user_id: int, days: int) -> bool:
     if not raw:
         return False
     now = _now()
-    try:
-        ts = datetime.fromisoformat(raw)
-    except Exception:
+    ms = _event_epoch_ms(raw, fallback_tz=now.tzinfo)
+    if ms is None:
         return False
-    if ts.tzinfo is None:
-        ts = ts.replace(tzinfo=now.tzinfo)
-    return ts >= (now - timedelta(days=days))
+    return ms >= _epoch_ms(now - timedelta(days=days))
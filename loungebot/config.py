@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from functools import lru_cache
 import os
 
 
@@ -12,6 +13,9 @@ class Settings:
     location_url: str
 
 
+# Environment is read once per process; Settings is frozen, so the instance is shared.
+# A missing BOT_TOKEN raises and is not cached. load_settings.cache_clear() re-reads.
+@lru_cache(maxsize=1)
 def load_settings() -> Settings:
     token = os.getenv("BOT_TOKEN", "").strip()
     if not token:
@@ -1,35 +1,81 @@
 import json
+import threading
 from pathlib import Path
 from typing import Any
 
 DATA_FILE = Path("data/guest_cards.json")
 
+# Parsed file kept in memory, keyed by (mtime_ns, size) so edits from outside are still picked up.
+_LOCK = threading.RLock()
+_CACHE: tuple[tuple[int, int], dict[str, Any]] | None = None
+# Registered user ids (as stored keys) for the cached dict; is_registered() is a set lookup.
+_REGISTERED: tuple[dict[str, Any], set[str]] | None = None
 
-def _load_data() -> dict[str, Any]:
-    if not DATA_FILE.exists():
-        return {}
 
+def _file_sig() -> tuple[int, int] | None:
     try:
-        return json.loads(DATA_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-        return {}
+        st = DATA_FILE.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _load_data() -> dict[str, Any]:
+    global _CACHE
+    with _LOCK:
+        sig = _file_sig()
+        if sig is None:
+            _CACHE = None
+            return {}
+        if _CACHE is not None and _CACHE[0] == sig:
+            return _CACHE[1]
+
+        try:
+            data = json.loads(DATA_FILE.read_bytes())
+        except (OSError, json.JSONDecodeError):
+            return {}
+        _CACHE = (sig, data)
+        return data
 
 
 def _save_data(data: dict[str, Any]) -> None:
-    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    DATA_FILE.write_text(
-        json.dumps(data, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    global _CACHE
+    with _LOCK:
+        DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+        # Compact: one entry per registered guest, rewritten on every registration.
+        DATA_FILE.write_text(
+            json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+            encoding="utf-8",
+        )
+        sig = _file_sig()
+        _CACHE = (sig, data) if sig is not None else None
+
+
+def _registered_ids() -> set[str]:
+    global _REGISTERED
+    with _LOCK:
+        data = _load_data()
+        if _REGISTERED is not None and _REGISTERED[0] is data:
+            return _REGISTERED[1]
+        ids = {
+            uid
+            for uid, user in data.items()
+            if isinstance(user, dict) and bool(user.get("registered", False))
+        }
+        _REGISTERED = (data, ids)
+        return ids
 
 
 def is_registered(user_id: int) -> bool:
-    data = _load_data()
-    user = data.get(str(user_id), {})
-    return bool(user.get("registered", False))
+    return str(user_id) in _registered_ids()
 
 
 def register_card(user_id: int) -> None:
-    data = _load_data()
-    data[str(user_id)] = {"registered": True}
-    _save_data(data)
+    with _LOCK:
+        if is_registered(user_id):
+            # Repeat taps on "register" don't need to rewrite the file.
+            return
+        data = _load_data()
+        data[str(user_id)] = {"registered": True}
+        _save_data(data)
+        _registered_ids().add(str(user_id))
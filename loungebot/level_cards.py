@@ -1,7 +1,15 @@
+import atexit
 import json
+import os
+import sys
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
+from functools import wraps
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator
 import random
 
 # Level rules (visits thresholds).
@@ -11,11 +19,36 @@ TIERS: list[tuple[int, str, int]] = [
     (15, "SILVER🥈", 7),
     (35, "GOLD🥇", 10),
 ]
+# Parallel views of TIERS for bisect lookups.
+_TIER_THRESHOLDS: tuple[int, ...] = tuple(t for t, _lvl, _disc in TIERS)
+_TIER_NAMES: tuple[str, ...] = tuple(lvl for _t, lvl, _disc in TIERS)
 
 DATA_FILE = Path("data/level_cards.json")
 
-
-@dataclass(frozen=True)
+# Parsed file kept in memory, keyed by (mtime_ns, size) so edits from outside are still picked up.
+# Mutators change the cached dict in place, so every public function holds _LOCK.
+_LOCK = threading.RLock()
+_CACHE: tuple[tuple[int, int] | None, dict[str, Any]] | None = None
+# Writes are coalesced like the stats file: _save() marks the cache dirty and a timer thread
+# writes it shortly after, so handlers never wait on serialize + fsync.
+FLUSH_DELAY_S = 2.0
+_DIRTY = False
+_FLUSH_TIMER: threading.Timer | None = None
+# Serializes flush() calls (timer vs atexit) while the file write itself runs outside _LOCK.
+_FLUSH_LOCK = threading.Lock()
+# Replays of the changes not yet on disk, oldest first. If the file is edited on disk under unflushed
+# changes, it is reloaded and these are re-applied on top instead of being overwritten by flush().
+_PENDING: list[Callable[[dict[str, Any]], Any]] = []
+# Open card_transaction() for this thread: the pinned dict, its replays and whether it needs a save on exit.
+_TXN: ContextVar[dict[str, Any] | None] = ContextVar("level_cards_txn", default=None)
+# list_cards() result for the dict it was built from; any _save() drops it, a reload replaces the dict.
+_CARDS: tuple[dict[str, Any], list["LevelCard"]] | None = None
+# Card number -> LevelCard built from the same dict, so repeated lookups of a card between saves
+# reuse one object instead of re-coercing nine fields. Dropped with _CARDS.
+_CARD_MEMO: tuple[dict[str, Any], dict[str, "LevelCard"]] | None = None
+
+
+@dataclass(frozen=True, slots=True)
 class LevelCard:
     card_number: str
     user_id: int
@@ -28,26 +61,184 @@ class LevelCard:
     staff_gold: bool
 
 
-def _load() -> dict[str, Any]:
-    if not DATA_FILE.exists():
-        return {"next_number": 4821, "by_number": {}, "by_user": {}}
+def _locked(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _LOCK:
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _file_sig() -> tuple[int, int] | None:
+    try:
+        st = DATA_FILE.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_file() -> tuple[tuple[int, int], dict[str, Any]] | None:
+    """(sig, data) of the file on disk, or None if it can't be read."""
     try:
-        data = json.loads(DATA_FILE.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
-        return {"next_number": 4821, "by_number": {}, "by_user": {}}
+        # Signature from the handle we actually read, so a concurrent rewrite can't pair new
+        # content with an old sig; the raw bytes are dropped as soon as they're parsed.
+        with DATA_FILE.open("rb") as f:
+            st = os.fstat(f.fileno())
+            raw = f.read()
+        sig = (st.st_mtime_ns, st.st_size)
+        data = json.loads(raw)
+        del raw
+    except (OSError, ValueError):
+        return None
     if not isinstance(data, dict):
-        return {"next_number": 4821, "by_number": {}, "by_user": {}}
+        return None
     data.setdefault("next_number", 4821)
     data.setdefault("by_number", {})
     data.setdefault("by_user", {})
-    return data
+    by_number = data["by_number"]
+    if isinstance(by_number, dict):
+        # A handful of distinct labels repeated on every card: share one string per label.
+        for rec in by_number.values():
+            if isinstance(rec, dict) and isinstance(rec.get("level"), str):
+                rec["level"] = sys.intern(rec["level"])
+    return sig, data
+
+
+def _rebase_pending() -> None:
+    """The file changed on disk under unflushed changes: take its version and replay ours on top."""
+    global _CACHE
+    loaded = _read_file()
+    if loaded is None:
+        # Can't read it right now; keep ours, the next check retries.
+        return
+    sig, data = loaded
+    for replay in _PENDING:
+        try:
+            replay(data)
+        except Exception:
+            continue
+    _CACHE = (sig, data)
 
 
-def _save(data: dict[str, Any]) -> None:
-    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    tmp = DATA_FILE.with_suffix(".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(DATA_FILE)
+def _load() -> dict[str, Any]:
+    global _CACHE
+    txn = _TXN.get()
+    if txn is not None:
+        return txn["data"]
+    with _LOCK:
+        sig = _file_sig()
+        if _DIRTY and _CACHE is not None:
+            # Unflushed changes are newer than our last read, but not necessarily than the file.
+            if sig not in (None, _CACHE[0]):
+                _rebase_pending()
+            return _CACHE[1]
+        if sig is None:
+            _CACHE = None
+            return {"next_number": 4821, "by_number": {}, "by_user": {}}
+        if _CACHE is not None and _CACHE[0] == sig:
+            return _CACHE[1]
+        loaded = _read_file()
+        if loaded is None:
+            return {"next_number": 4821, "by_number": {}, "by_user": {}}
+        _CACHE = loaded
+        return loaded[1]
+
+
+def _save(data: dict[str, Any], replay: Callable[[dict[str, Any]], Any]) -> None:
+    """Mark `data` changed; `replay` re-applies the same change to a freshly loaded dict."""
+    global _CARDS, _CARD_MEMO
+    _CARDS = None
+    _CARD_MEMO = None
+    txn = _TXN.get()
+    if txn is not None and txn["data"] is data:
+        txn["ops"].append(replay)
+        txn["dirty"] = True
+        return
+    with _LOCK:
+        _PENDING.append(replay)
+    _schedule_flush(data)
+
+
+def _schedule_flush(data: dict[str, Any]) -> None:
+    global _CACHE, _DIRTY, _FLUSH_TIMER
+    with _LOCK:
+        _CACHE = (_CACHE[0] if _CACHE is not None else None, data)
+        _DIRTY = True
+        if _FLUSH_TIMER is None:
+            _FLUSH_TIMER = threading.Timer(FLUSH_DELAY_S, flush)
+            _FLUSH_TIMER.daemon = True
+            _FLUSH_TIMER.start()
+
+
+def flush() -> None:
+    """Write pending card changes to disk (called by the timer and at exit)."""
+    global _CACHE, _DIRTY, _FLUSH_TIMER
+    with _FLUSH_LOCK:
+        for attempt in range(3):
+            with _LOCK:
+                if _FLUSH_TIMER is not None:
+                    _FLUSH_TIMER.cancel()
+                    _FLUSH_TIMER = None
+                if not _DIRTY or _CACHE is None:
+                    return
+                if _file_sig() not in (None, _CACHE[0]):
+                    _rebase_pending()
+                base_sig, data = _CACHE
+                # Serialize under the lock (the dict is mutated in place), write outside it.
+                # Compact: with indent= json falls back to its pure-Python encoder, and the file gets twice as big.
+                payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                flushed = len(_PENDING)
+                _DIRTY = False
+            try:
+                DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+                tmp = DATA_FILE.with_suffix(".tmp")
+                # fsync before the rename so what this flush writes survives a power loss; changes
+                # from the last FLUSH_DELAY_S are still only in memory until the next flush.
+                with tmp.open("w", encoding="utf-8") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    st = os.fstat(f.fileno())
+                with _LOCK:
+                    # Edited on disk since the snapshot: merge and snapshot again rather than overwrite.
+                    if _file_sig() not in (None, base_sig) and attempt < 2:
+                        _DIRTY = True
+                        continue
+                    tmp.replace(DATA_FILE)
+                    del _PENDING[:flushed]
+                    if _CACHE is not None and _CACHE[1] is data:
+                        # Changes made since the snapshot are still in _PENDING, on top of this file.
+                        _CACHE = ((st.st_mtime_ns, st.st_size), data)
+                return
+            except Exception:
+                with _LOCK:
+                    _DIRTY = True
+                raise
+
+
+atexit.register(flush)
+
+
+@contextmanager
+def card_transaction() -> Iterator[None]:
+    """
+    Pin one loaded dict for a multi-step flow: nested calls reuse it and it is saved once on exit.
+    Wrap bulk updates (e.g. add_visit_by_user_id() over many users) in it to mutate under one lock hold.
+    """
+    if _TXN.get() is not None:
+        yield
+        return
+    with _LOCK:
+        txn: dict[str, Any] = {"data": _load(), "ops": [], "dirty": False}
+        token = _TXN.set(txn)
+        try:
+            yield
+        finally:
+            _TXN.reset(token)
+            if txn["dirty"]:
+                _PENDING.extend(txn["ops"])
+                _schedule_flush(txn["data"])
 
 
 def _to_card(card_number: str, rec: dict[str, Any]) -> LevelCard:
@@ -64,8 +255,20 @@ def _to_card(card_number: str, rec: dict[str, Any]) -> LevelCard:
     )
 
 
-def tier_for_visits(visits: int) -> tuple[str, int]:
-    v = int(visits or 0)
+def _cached_card(data: dict[str, Any], card_number: str, rec: dict[str, Any]) -> LevelCard:
+    """_to_card() for a record of the loaded `data`, memoized until the next save or reload."""
+    global _CARD_MEMO
+    if _CARD_MEMO is None or _CARD_MEMO[0] is not data:
+        _CARD_MEMO = (data, {})
+    memo = _CARD_MEMO[1]
+    card = memo.get(card_number)
+    if card is None:
+        card = _to_card(card_number, rec)
+        memo[card_number] = card
+    return card
+
+
+def _scan_tier(v: int) -> tuple[str, int]:
     if v <= 0:
         return ("-", 0)
     level = TIERS[0][1]
@@ -79,15 +282,28 @@ def tier_for_visits(visits: int) -> tuple[str, int]:
     return (level, discount)
 
 
+# tier_for_visits() for every count up to the top threshold; anything above it is the top tier.
+_TIER_TABLE: tuple[tuple[str, int], ...] = tuple(_scan_tier(v) for v in range(TIERS[-1][0] + 1))
+
+
+def tier_for_visits(visits: int) -> tuple[str, int]:
+    v = int(visits or 0)
+    if v <= 0:
+        return ("-", 0)
+    if v < len(_TIER_TABLE):
+        return _TIER_TABLE[v]
+    return _TIER_TABLE[-1]
+
+
 def next_tier_info(visits: int) -> tuple[str, int] | None:
     """
     Returns (next_level_label, remaining_visits) or None if already max.
     """
     v = int(visits or 0)
-    for threshold, lvl, _disc in TIERS:
-        if v < threshold:
-            return (lvl, threshold - v)
-    return None
+    i = bisect_right(_TIER_THRESHOLDS, v)
+    if i == len(_TIER_THRESHOLDS):
+        return None
+    return (_TIER_NAMES[i], _TIER_THRESHOLDS[i] - v)
 
 
 def _recalc(rec: dict[str, Any]) -> None:
@@ -114,36 +330,32 @@ def _is_bad_number(n: int) -> bool:
     return len(set(s)) == 1
 
 
+# Every allocatable card number, formatted once: 0010..9998 without the repdigits.
+_CARD_NUMBERS: tuple[str, ...] = tuple(f"{n:04d}" for n in range(10, 9999) if not _is_bad_number(n))
+
+
 def _alloc_random_card_number(by_number: dict[str, Any]) -> str:
     """
     Allocate a unique random 4-digit card number.
     Range: 0010..9998 (inclusive), excluding 0000/1111/2222/.../9999.
     """
     rng = random.SystemRandom()
-    used = set(str(k) for k in by_number.keys())
 
-    # Fast random attempts.
-    for _ in range(5000):
-        n = rng.randint(10, 9998)
-        if _is_bad_number(n):
-            continue
-        s = f"{n:04d}"
-        if s in used:
-            continue
-        return s
+    # Fast random attempts (by_number keys are the card number strings).
+    if len(by_number) < len(_CARD_NUMBERS) // 2:
+        for _ in range(5000):
+            s = rng.choice(_CARD_NUMBERS)
+            if s not in by_number:
+                return s
 
-    # Fallback: deterministic scan.
-    for n in range(10, 9999):
-        if n > 9998:
-            break
-        if _is_bad_number(n):
-            continue
-        s = f"{n:04d}"
-        if s not in used:
-            return s
-    raise RuntimeError("No available card numbers")
+    # Crowded space: pick among what is left.
+    free = [s for s in _CARD_NUMBERS if s not in by_number]
+    if not free:
+        raise RuntimeError("No available card numbers")
+    return rng.choice(free)
 
 
+@_locked
 def ensure_level_card(
     user_id: int,
     *,
@@ -156,6 +368,33 @@ def ensure_level_card(
     Defaults: IRON⚙️, 3% discount. Card numbers are allocated sequentially.
     """
     data = _load()
+    card_number, rec, changed = _ensure_level_card_in(
+        data, user_id, username=username, first_name=first_name, last_name=last_name
+    )
+    if changed:
+        _save(
+            data,
+            lambda d: _ensure_level_card_in(
+                d, user_id, username=username, first_name=first_name, last_name=last_name,
+                card_number=card_number,
+            ),
+        )
+    return _to_card(card_number, rec)
+
+
+def _ensure_level_card_in(
+    data: dict[str, Any],
+    user_id: int,
+    *,
+    username: str | None = None,
+    first_name: str | None = None,
+    last_name: str | None = None,
+    card_number: str | None = None,
+) -> tuple[str, dict[str, Any], bool]:
+    """
+    ensure_level_card() on an already loaded dict; the caller saves if the flag says it changed.
+    A new card gets `card_number` if given and still free (replays keep the number already shown).
+    """
     by_user: dict[str, Any] = data.get("by_user", {})
     by_number: dict[str, Any] = data.get("by_number", {})
 
@@ -165,6 +404,7 @@ def ensure_level_card(
         rec = by_number[str(existing_num)]
         # refresh user info if present
         if isinstance(rec, dict):
+            before = dict(rec)
             if username:
                 rec["username"] = username
             if first_name:
@@ -173,11 +413,11 @@ def ensure_level_card(
                 rec["last_name"] = last_name
             # Ensure level/discount are consistent with visits.
             _recalc(rec)
-            _save(data)
-            return _to_card(str(existing_num), rec)
+            return str(existing_num), rec, rec != before
 
     # Allocate a random unique 4-digit card number.
-    card_number = _alloc_random_card_number(by_number)
+    if card_number is None or card_number in by_number:
+        card_number = _alloc_random_card_number(by_number)
     by_user[uid] = card_number
     by_number[card_number] = {
         "user_id": int(user_id),
@@ -196,10 +436,10 @@ def ensure_level_card(
     data["next_number"] = int(data.get("next_number", 4821) or 4821)
     data["by_user"] = by_user
     data["by_number"] = by_number
-    _save(data)
-    return _to_card(card_number, by_number[card_number])
+    return card_number, by_number[card_number], True
 
 
+@_locked
 def find_card_by_number(card_number: str) -> LevelCard | None:
     s = (card_number or "").strip()
     if not s:
@@ -208,9 +448,10 @@ def find_card_by_number(card_number: str) -> LevelCard | None:
     rec = (data.get("by_number") or {}).get(s)
     if not isinstance(rec, dict):
         return None
-    return _to_card(s, rec)
+    return _cached_card(data, s, rec)
 
 
+@_locked
 def find_card_by_user_id(user_id: int) -> LevelCard | None:
     data = _load()
     by_user = data.get("by_user") or {}
@@ -221,9 +462,10 @@ def find_card_by_user_id(user_id: int) -> LevelCard | None:
     rec = by_number.get(str(num))
     if not isinstance(rec, dict):
         return None
-    return _to_card(str(num), rec)
+    return _cached_card(data, str(num), rec)
 
 
+@_locked
 def add_visit_by_user_id(user_id: int, delta: int = 1) -> LevelCard | None:
     """
     Increment total confirmed visits for a user.
@@ -231,6 +473,14 @@ def add_visit_by_user_id(user_id: int, delta: int = 1) -> LevelCard | None:
     if delta <= 0:
         return find_card_by_user_id(user_id)
     data = _load()
+    hit = _add_visit_in(data, user_id, delta)
+    if hit is None:
+        return None
+    _save(data, lambda d: _add_visit_in(d, user_id, delta))
+    return _to_card(*hit)
+
+
+def _add_visit_in(data: dict[str, Any], user_id: int, delta: int) -> tuple[str, dict[str, Any]] | None:
     by_user = data.get("by_user") or {}
     by_number = data.get("by_number") or {}
     num = by_user.get(str(int(user_id)))
@@ -241,10 +491,10 @@ def add_visit_by_user_id(user_id: int, delta: int = 1) -> LevelCard | None:
         return None
     rec["visits"] = int(rec.get("visits", 0) or 0) + int(delta)
     _recalc(rec)
-    _save(data)
-    return _to_card(str(num), rec)
+    return str(num), rec
 
 
+@_locked
 def set_staff_gold_by_user_id(
     user_id: int,
     *,
@@ -254,17 +504,34 @@ def set_staff_gold_by_user_id(
     first_name: str | None = None,
     last_name: str | None = None,
 ) -> LevelCard:
-    # Ensure card exists.
-    card = ensure_level_card(user_id, username=username, first_name=first_name, last_name=last_name)
-    # Reload to ensure we see records created/updated by ensure_level_card().
+    # Ensure card exists (same loaded dict, one save at the end).
     data = _load()
-    by_user = data.get("by_user") or {}
-    by_number = data.get("by_number") or {}
-    num = by_user.get(str(int(user_id))) or card.card_number
-    rec = by_number.get(str(num))
-    if not isinstance(rec, dict):
-        # Shouldn't happen, but keep safe.
-        return card
+    kwargs = {
+        "staff_level": staff_level, "staff_discount": staff_discount,
+        "username": username, "first_name": first_name, "last_name": last_name,
+    }
+    num, rec, changed = _set_staff_gold_in(data, user_id, **kwargs)
+    if changed:
+        _save(data, lambda d: _set_staff_gold_in(d, user_id, card_number=num, **kwargs))
+    return _to_card(num, rec)
+
+
+def _set_staff_gold_in(
+    data: dict[str, Any],
+    user_id: int,
+    *,
+    staff_level: str | None = None,
+    staff_discount: int | None = None,
+    username: str | None = None,
+    first_name: str | None = None,
+    last_name: str | None = None,
+    card_number: str | None = None,
+) -> tuple[str, dict[str, Any], bool]:
+    num, rec, changed = _ensure_level_card_in(
+        data, user_id, username=username, first_name=first_name, last_name=last_name,
+        card_number=card_number,
+    )
+    before = dict(rec)
     rec["staff_gold"] = True
     if staff_level:
         rec["staff_level"] = str(staff_level)
@@ -273,19 +540,25 @@ def set_staff_gold_by_user_id(
             rec["staff_discount"] = int(staff_discount)
         except Exception:
             rec["staff_discount"] = 10
-    if username:
-        rec["username"] = username
-    if first_name:
-        rec["first_name"] = first_name
-    if last_name:
-        rec["last_name"] = last_name
     _recalc(rec)
-    _save(data)
-    return _to_card(str(num), rec)
+    # Called on every staff update; most of the time the card is already like this.
+    return num, rec, changed or rec != before
 
 
+@_locked
 def clear_staff_gold_by_user_id(user_id: int) -> LevelCard | None:
     data = _load()
+    hit = _clear_staff_gold_in(data, user_id)
+    if hit is None:
+        return None
+    num, rec, changed = hit
+    # Called on every non-staff update; skip the rewrite when there was no staff card to clear.
+    if changed:
+        _save(data, lambda d: _clear_staff_gold_in(d, user_id))
+    return _to_card(num, rec)
+
+
+def _clear_staff_gold_in(data: dict[str, Any], user_id: int) -> tuple[str, dict[str, Any], bool] | None:
     by_user = data.get("by_user") or {}
     by_number = data.get("by_number") or {}
     num = by_user.get(str(int(user_id)))
@@ -294,19 +567,24 @@ def clear_staff_gold_by_user_id(user_id: int) -> LevelCard | None:
     rec = by_number.get(str(num))
     if not isinstance(rec, dict):
         return None
+    before = dict(rec)
     rec["staff_gold"] = False
     rec.pop("staff_level", None)
     rec.pop("staff_discount", None)
     _recalc(rec)
-    _save(data)
-    return _to_card(str(num), rec)
+    return str(num), rec, rec != before
 
 
+@_locked
 def list_cards() -> list[LevelCard]:
     """
     Returns all cards from storage (best-effort, unsorted).
     """
+    global _CARDS
     data = _load()
+    if _CARDS is not None and _CARDS[0] is data:
+        # LevelCard is frozen; only the list itself needs copying.
+        return list(_CARDS[1])
     by_number = data.get("by_number") or {}
     out: list[LevelCard] = []
     if not isinstance(by_number, dict):
@@ -315,7 +593,8 @@ def list_cards() -> list[LevelCard]:
         if not isinstance(rec, dict):
             continue
         try:
-            out.append(_to_card(str(num), rec))
+            out.append(_cached_card(data, str(num), rec))
         except Exception:
             continue
-    return out
+    _CARDS = (data, out)
+    return list(out)